@@ -0,0 +1,66 @@
+from functools import lru_cache
+from typing import Any, Callable, TypeVar
+import asyncio
+import httpx
+from postgrest.exceptions import APIError
+from storage3.utils import StorageException
+from supabase import Client, create_client
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from .config import get_settings
+
+T = TypeVar('T')
+
+# Bounds in-flight Supabase requests across all services so a burst of
+# requests queues here instead of exhausting the connection pooler
+_supabase_semaphore = asyncio.Semaphore(get_settings().SUPABASE_CONCURRENCY)
+
+# Responses meaning the request was turned away before it was processed
+RETRYABLE_STATUSES = frozenset({429, 503})
+MAX_RETRIES = 4
+
+def _is_transient_error(error: BaseException) -> bool:
+    """Whether a failed Supabase call can safely be tried again."""
+    # The request never reached the server
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, APIError):
+        # postgrest only reports the HTTP status when the body wasn't JSON
+        status = error.code
+    elif isinstance(error, StorageException) and error.args and isinstance(error.args[0], dict):
+        status = error.args[0].get('statusCode')
+    else:
+        return False
+    try:
+        return int(status) in RETRYABLE_STATUSES
+    except (TypeError, ValueError):
+        return False
+
+@lru_cache()
+def get_supabase() -> Client:
+    """
+    Return the process-wide Supabase client.
+
+    Services fall back to this when no client is injected, so they share one
+    set of HTTP connection pools instead of each opening their own.
+    """
+    settings = get_settings()
+    return create_client(
+        supabase_url=settings.SUPABASE_URL,
+        supabase_key=settings.SUPABASE_KEY
+    )
+
+@retry(retry=retry_if_exception(_is_transient_error),
+       stop=stop_after_attempt(MAX_RETRIES),
+       wait=wait_exponential_jitter(initial=0.1, max=2.0),
+       reraise=True)
+async def run_supabase(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking Supabase call in a worker thread.
+
+    At most SUPABASE_CONCURRENCY calls run at once; the rest wait their turn.
+    Calls rejected with 429/503, or that could not connect, are retried with
+    jittered exponential backoff, so fn must be safe to call again.
+    """
+    async with _supabase_semaphore:
+        return await asyncio.to_thread(fn, *args, **kwargs)
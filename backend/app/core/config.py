@@ -14,11 +14,14 @@ class Settings(BaseSettings):
     # Database
     SUPABASE_URL: str
     SUPABASE_KEY: str
+    SUPABASE_CONCURRENCY: int = 15  # Max concurrent Supabase requests; keep below the pooler's client limit
     
     # OpenAI
     OPENAI_API_KEY: str
     OPENAI_MODEL: str = "gpt-5.4"
     EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    OPENAI_CONCURRENCY: int = 32  # Max concurrent embeddings requests; size to your rate-limit tier
+    OPENAI_RPM: int = 3000  # Embeddings requests per minute allowed by your rate-limit tier
     
     # CORS
     BACKEND_CORS_ORIGINS: List[str] = [
@@ -39,6 +42,9 @@ class Settings(BaseSettings):
     HIGHLY_RELEVANT_THRESHOLD: float = 0.8
     
     # Embedding Generation
+    CHUNK_SIZE_TOKENS: int = 512
+    CHUNK_OVERLAP_TOKENS: int = 50
+    # Character-based fallback used when tiktoken is not installed
     CHUNK_SIZE: int = 2000
     CHUNK_OVERLAP: int = 300
     
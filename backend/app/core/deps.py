@@ -1,11 +1,13 @@
 from fastapi import Depends, HTTPException, status, Request
-from supabase import Client, create_client
+from supabase import Client
 from typing import Optional
+from functools import lru_cache
 from uuid import UUID
 import logging
 import traceback
 
 from .config import get_settings
+from .clients import get_supabase
 from ..services.settings_service import SettingsService
 from ..services.storage_service import StorageService
 from ..services.search_service import SearchService
@@ -18,38 +20,46 @@ from ..services.api_key_service import APIKeyService
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+@lru_cache()
+def _create_supabase_client() -> Client:
+    """
+    Create the Supabase client shared by every request.
+
+    Reusing one client keeps its HTTP connection pools (and their TCP/TLS
+    connections) alive across requests. Failures are not cached, so a
+    later request tries again.
+    """
+    # Log connection attempt (without exposing sensitive data)
+    logger.info(f"Attempting to connect to Supabase at URL: {settings.SUPABASE_URL}")
+    logger.info("Supabase key length: " + str(len(settings.SUPABASE_KEY)) if settings.SUPABASE_KEY else "No key provided")
+
+    if not settings.SUPABASE_URL or not settings.SUPABASE_URL.startswith('https://'):
+        logger.error(f"Invalid Supabase URL format: {settings.SUPABASE_URL}")
+        raise ValueError("Invalid Supabase URL format")
+
+    if not settings.SUPABASE_KEY:
+        logger.error("Supabase key is missing or empty")
+        raise ValueError("Supabase key is required")
+
+    # Services constructed without a client fall back to this same instance
+    client = get_supabase()
+
+    # Test the connection with a simpler health check
+    logger.info("Testing Supabase connection...")
+    try:
+        # Just verify we can access the auth API
+        client.auth.get_session()
+        logger.info("Supabase connection test successful")
+    except Exception as e:
+        logger.error(f"Connection test failed: {str(e)}")
+        raise
+    
+    return client
+
 def get_supabase_client() -> Client:
     """Get Supabase client instance."""
     try:
-        # Log connection attempt (without exposing sensitive data)
-        logger.info(f"Attempting to connect to Supabase at URL: {settings.SUPABASE_URL}")
-        logger.info("Supabase key length: " + str(len(settings.SUPABASE_KEY)) if settings.SUPABASE_KEY else "No key provided")
-
-        if not settings.SUPABASE_URL or not settings.SUPABASE_URL.startswith('https://'):
-            logger.error(f"Invalid Supabase URL format: {settings.SUPABASE_URL}")
-            raise ValueError("Invalid Supabase URL format")
-
-        if not settings.SUPABASE_KEY:
-            logger.error("Supabase key is missing or empty")
-            raise ValueError("Supabase key is required")
-
-        # Create client with correct options structure
-        client = create_client(
-            supabase_url=settings.SUPABASE_URL,
-            supabase_key=settings.SUPABASE_KEY
-        )
-
-        # Test the connection with a simpler health check
-        logger.info("Testing Supabase connection...")
-        try:
-            # Just verify we can access the auth API
-            client.auth.get_session()
-            logger.info("Supabase connection test successful")
-        except Exception as e:
-            logger.error(f"Connection test failed: {str(e)}")
-            raise
-        
-        return client
+        return _create_supabase_client()
 
     except ValueError as ve:
         logger.error(f"Validation error: {str(ve)}")
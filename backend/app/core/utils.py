@@ -1,9 +1,52 @@
 import tiktoken
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Hashable, Optional, Tuple
+from collections import OrderedDict
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+class TTLCache:
+    """
+    Small in-process LRU cache whose entries expire a fixed time after being set.
+
+    Used to absorb repeated reads of the same Supabase rows; writers call pop()
+    so the next read fetches fresh data.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or default if it is missing or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache a value, evicting the least recently used entries beyond maxsize."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Drop a cached value, if present."""
+        self._data.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> None:
+        """Drop every cached value for which predicate(value) is true."""
+        for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
 def count_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4o") -> int:
     """
     Count the number of tokens in a list of messages.
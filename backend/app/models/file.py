@@ -20,13 +20,10 @@ class FileBase(BaseModel):
 
 class FileCreate(FileBase):
     def model_dump(self, **kwargs):
-        data = super().model_dump(**kwargs)
-        # Ensure UUID is converted to string
-        data['user_id'] = str(data['user_id'])
-        # Convert date to ISO string for database
-        if data.get('document_date'):
-            data['document_date'] = data['document_date'].isoformat()
-        return data
+        # Dump for the database: Pydantic's JSON mode renders the UUID and
+        # date as strings in the same pass
+        kwargs.setdefault('mode', 'json')
+        return super().model_dump(**kwargs)
 
 class FileDB(FileBase):
     id: UUID
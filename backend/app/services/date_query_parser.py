@@ -12,7 +12,6 @@ import re
 from datetime import date, timedelta
 from dataclasses import dataclass
 from typing import Optional, Tuple
-from calendar import monthrange
 import logging
 
 logger = logging.getLogger(__name__)
@@ -40,6 +39,30 @@ MONTH_DISPLAY_NAMES = {
     9: 'September', 10: 'October', 11: 'November', 12: 'December'
 }
 
+# Month number keyed by the first three letters, which are unique across
+# MONTH_NAMES; the month patterns only ever capture one of those names
+_MONTH_BY_PREFIX = {name[:3]: month for name, month in MONTH_NAMES.items()}
+
+# Month alternation shared by the month patterns, longest names first so
+# "september" is tried before "sept" and "sep"
+_MONTH_ALT = '|'.join(sorted(MONTH_NAMES, key=len, reverse=True))
+
+# Collapses runs of whitespace left behind after removing a temporal phrase
+_WHITESPACE = re.compile(r'\s+')
+
+# Queries without any digit can skip every pattern that requires one
+_DIGIT = re.compile(r'\d')
+
+# Days per month in a non-leap year, indexed by month number
+_DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _last_day(year: int, month: int) -> int:
+    """Return the last day of the given month."""
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return _DAYS_IN_MONTH[month]
+
 
 @dataclass
 class DateRange:
@@ -66,34 +89,38 @@ class DateQueryParser:
     """Parses user queries for temporal intent and extracts date ranges."""
 
     # Patterns for relative time expressions
+    # Each entry is (pattern, handler name, whether the pattern requires a digit)
     RELATIVE_PATTERNS = [
-        # "yesterday"
-        (r'\byesterday\b', '_parse_yesterday'),
-        # "today"
-        (r'\btoday\b', '_parse_today'),
-        # "last week"
-        (r'\blast\s+week\b', '_parse_last_week'),
-        # "this week"
-        (r'\bthis\s+week\b', '_parse_this_week'),
-        # "last month"
-        (r'\blast\s+month\b', '_parse_last_month'),
-        # "this month"
-        (r'\bthis\s+month\b', '_parse_this_month'),
-        # "last N days"
-        (r'\blast\s+(\d+)\s+days?\b', '_parse_last_n_days'),
-        # "N days ago"
-        (r'(\d+)\s+days?\s+ago\b', '_parse_n_days_ago'),
+        (re.compile(pattern, re.IGNORECASE), method_name, needs_digit)
+        for pattern, method_name, needs_digit in [
+            # "yesterday"
+            (r'\byesterday\b', '_parse_yesterday', False),
+            # "today"
+            (r'\btoday\b', '_parse_today', False),
+            # "last week"
+            (r'\blast\s+week\b', '_parse_last_week', False),
+            # "this week"
+            (r'\bthis\s+week\b', '_parse_this_week', False),
+            # "last month"
+            (r'\blast\s+month\b', '_parse_last_month', False),
+            # "this month"
+            (r'\bthis\s+month\b', '_parse_this_month', False),
+            # "last N days"
+            (r'\blast\s+(\d+)\s+days?\b', '_parse_last_n_days', True),
+            # "N days ago"
+            (r'(\d+)\s+days?\s+ago\b', '_parse_n_days_ago', True),
+        ]
     ]
 
     # Pattern for month with optional year: "in January", "January 2024", "in Jan 2024", "in February of 2021"
     MONTH_PATTERN = re.compile(
-        r'(?:in\s+)?(' + '|'.join(MONTH_NAMES.keys()) + r')(?:\s+(?:of\s+)?(\d{4})|\s+of\s+(\d{4}))?\b',
+        rf'(?:in\s+)?({_MONTH_ALT})(?:\s+(?:of\s+)?(\d{{4}})|\s+of\s+(\d{{4}}))?\b',
         re.IGNORECASE
     )
 
     # Pattern for specific date: "on January 15", "January 15, 2024", "February 8 in 2021"
     SPECIFIC_DATE_PATTERN = re.compile(
-        r'(?:on\s+)?(' + '|'.join(MONTH_NAMES.keys()) + r')\s+(\d{1,2})(?:st|nd|rd|th)?(?:\s*,?\s*(\d{4})|\s+(?:in|of)\s+(\d{4}))?\b',
+        rf'(?:on\s+)?({_MONTH_ALT})\s+(\d{{1,2}})(?:st|nd|rd|th)?(?:\s*,?\s*(\d{{4}})|\s+(?:in|of)\s+(\d{{4}}))?\b',
         re.IGNORECASE
     )
 
@@ -119,20 +146,26 @@ class DateQueryParser:
                 has_temporal_intent=False
             )
 
+        # Resolve "today" once and share it across all patterns
+        today = date.today()
+        # Specific and ISO dates (and "N days" phrases) can only match with a digit present
+        has_digit = _DIGIT.search(query) is not None
+
         # Try each pattern type
-        result = self._try_relative_patterns(query)
+        result = self._try_relative_patterns(query, today, has_digit)
         if result:
             return result
 
-        result = self._try_specific_date_pattern(query)
-        if result:
-            return result
+        if has_digit:
+            result = self._try_specific_date_pattern(query, today)
+            if result:
+                return result
 
-        result = self._try_iso_date_pattern(query)
-        if result:
-            return result
+            result = self._try_iso_date_pattern(query)
+            if result:
+                return result
 
-        result = self._try_month_pattern(query)
+        result = self._try_month_pattern(query, today)
         if result:
             return result
 
@@ -143,15 +176,17 @@ class DateQueryParser:
             has_temporal_intent=False
         )
 
-    def _try_relative_patterns(self, query: str) -> Optional[ParsedQuery]:
+    def _try_relative_patterns(self, query: str, today: date, has_digit: bool = True) -> Optional[ParsedQuery]:
         """Try to match relative time patterns."""
-        for pattern, method_name in self.RELATIVE_PATTERNS:
-            match = re.search(pattern, query, re.IGNORECASE)
+        for pattern, method_name, needs_digit in self.RELATIVE_PATTERNS:
+            if needs_digit and not has_digit:
+                continue
+            match = pattern.search(query)
             if match:
                 method = getattr(self, method_name)
-                date_range, description = method(match)
-                clean_query = re.sub(pattern, '', query, flags=re.IGNORECASE).strip()
-                clean_query = re.sub(r'\s+', ' ', clean_query)  # Normalize whitespace
+                date_range, description = method(match, today)
+                # Remove the phrase and normalize whitespace
+                clean_query = _WHITESPACE.sub(' ', pattern.sub('', query)).strip()
 
                 return ParsedQuery(
                     clean_query=clean_query or query,  # Keep original if nothing left
@@ -161,20 +196,14 @@ class DateQueryParser:
                 )
         return None
 
-    def _try_month_pattern(self, query: str) -> Optional[ParsedQuery]:
+    def _try_month_pattern(self, query: str, today: date) -> Optional[ParsedQuery]:
         """Try to match month patterns like 'in January', 'January 2024', or 'in February of 2021'."""
         match = self.MONTH_PATTERN.search(query)
         if match:
-            month_str = match.group(1).lower()
+            month = _MONTH_BY_PREFIX[match.group(1)[:3].lower()]
             # Year can be in group 2 (e.g., "January 2024") or group 3 (e.g., "January of 2024")
             year_str = match.group(2) or match.group(3)
 
-            month = MONTH_NAMES.get(month_str)
-            if month is None:
-                return None
-
-            today = date.today()
-
             if year_str:
                 year = int(year_str)
             else:
@@ -184,20 +213,16 @@ class DateQueryParser:
                 if month > today.month:
                     year -= 1
 
-            # Get the last day of the month
-            _, last_day = monthrange(year, month)
-
             date_range = DateRange(
                 start=date(year, month, 1),
-                end=date(year, month, last_day)
+                end=date(year, month, _last_day(year, month))
             )
 
             month_name = MONTH_DISPLAY_NAMES[month]
             description = f"{month_name} {year}"
 
             # Remove the matched text from the query
-            clean_query = query[:match.start()] + query[match.end():]
-            clean_query = re.sub(r'\s+', ' ', clean_query).strip()
+            clean_query = _WHITESPACE.sub(' ', self.MONTH_PATTERN.sub('', query, count=1)).strip()
 
             return ParsedQuery(
                 clean_query=clean_query or query,
@@ -207,21 +232,15 @@ class DateQueryParser:
             )
         return None
 
-    def _try_specific_date_pattern(self, query: str) -> Optional[ParsedQuery]:
+    def _try_specific_date_pattern(self, query: str, today: date) -> Optional[ParsedQuery]:
         """Try to match specific date patterns like 'January 15', 'on January 15, 2024', or 'February 8 in 2021'."""
         match = self.SPECIFIC_DATE_PATTERN.search(query)
         if match:
-            month_str = match.group(1).lower()
+            month = _MONTH_BY_PREFIX[match.group(1)[:3].lower()]
             day = int(match.group(2))
             # Year can be in group 3 (e.g., "January 15, 2024") or group 4 (e.g., "February 8 in 2021")
             year_str = match.group(3) or match.group(4)
 
-            month = MONTH_NAMES.get(month_str)
-            if month is None:
-                return None
-
-            today = date.today()
-
             if year_str:
                 year = int(year_str)
             else:
@@ -244,8 +263,7 @@ class DateQueryParser:
             month_name = MONTH_DISPLAY_NAMES[month]
             description = f"{month_name} {day}, {year}"
 
-            clean_query = query[:match.start()] + query[match.end():]
-            clean_query = re.sub(r'\s+', ' ', clean_query).strip()
+            clean_query = _WHITESPACE.sub(' ', self.SPECIFIC_DATE_PATTERN.sub('', query, count=1)).strip()
 
             return ParsedQuery(
                 clean_query=clean_query or query,
@@ -270,8 +288,7 @@ class DateQueryParser:
             date_range = DateRange(start=specific_date, end=specific_date)
             description = specific_date.strftime('%B %d, %Y')
 
-            clean_query = query[:match.start()] + query[match.end():]
-            clean_query = re.sub(r'\s+', ' ', clean_query).strip()
+            clean_query = _WHITESPACE.sub(' ', self.ISO_DATE_PATTERN.sub('', query, count=1)).strip()
 
             return ParsedQuery(
                 clean_query=clean_query or query,
@@ -283,53 +300,47 @@ class DateQueryParser:
 
     # Methods for relative patterns
 
-    def _parse_yesterday(self, match: re.Match) -> Tuple[DateRange, str]:
-        yesterday = date.today() - timedelta(days=1)
+    def _parse_yesterday(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
+        yesterday = today - timedelta(days=1)
         return DateRange(start=yesterday, end=yesterday), "yesterday"
 
-    def _parse_today(self, match: re.Match) -> Tuple[DateRange, str]:
-        today = date.today()
+    def _parse_today(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
         return DateRange(start=today, end=today), "today"
 
-    def _parse_last_week(self, match: re.Match) -> Tuple[DateRange, str]:
-        today = date.today()
+    def _parse_last_week(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
         start = today - timedelta(days=7)
         return DateRange(start=start, end=today), "last 7 days"
 
-    def _parse_this_week(self, match: re.Match) -> Tuple[DateRange, str]:
-        today = date.today()
+    def _parse_this_week(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
         # Start of week (Monday)
         start = today - timedelta(days=today.weekday())
         return DateRange(start=start, end=today), "this week"
 
-    def _parse_last_month(self, match: re.Match) -> Tuple[DateRange, str]:
-        today = date.today()
+    def _parse_last_month(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
+        year, month = today.year, today.month
         # First day of last month
-        if today.month == 1:
-            start = date(today.year - 1, 12, 1)
-            _, last_day = monthrange(today.year - 1, 12)
-            end = date(today.year - 1, 12, last_day)
+        if month == 1:
+            start = date(year - 1, 12, 1)
+            end = date(year - 1, 12, 31)
         else:
-            start = date(today.year, today.month - 1, 1)
-            _, last_day = monthrange(today.year, today.month - 1)
-            end = date(today.year, today.month - 1, last_day)
+            start = date(year, month - 1, 1)
+            end = date(year, month - 1, _last_day(year, month - 1))
 
         month_name = MONTH_DISPLAY_NAMES[start.month]
         return DateRange(start=start, end=end), f"last month ({month_name})"
 
-    def _parse_this_month(self, match: re.Match) -> Tuple[DateRange, str]:
-        today = date.today()
-        start = date(today.year, today.month, 1)
-        month_name = MONTH_DISPLAY_NAMES[today.month]
+    def _parse_this_month(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
+        month = today.month
+        start = date(today.year, month, 1)
+        month_name = MONTH_DISPLAY_NAMES[month]
         return DateRange(start=start, end=today), f"this month ({month_name})"
 
-    def _parse_last_n_days(self, match: re.Match) -> Tuple[DateRange, str]:
+    def _parse_last_n_days(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
         n = int(match.group(1))
-        today = date.today()
         start = today - timedelta(days=n)
         return DateRange(start=start, end=today), f"last {n} days"
 
-    def _parse_n_days_ago(self, match: re.Match) -> Tuple[DateRange, str]:
+    def _parse_n_days_ago(self, match: re.Match, today: date) -> Tuple[DateRange, str]:
         n = int(match.group(1))
-        target_date = date.today() - timedelta(days=n)
+        target_date = today - timedelta(days=n)
         return DateRange(start=target_date, end=target_date), f"{n} days ago"
@@ -1,9 +1,41 @@
-from typing import List, Optional
-from openai import OpenAI
+from typing import Dict, List, Optional, Set, Tuple
+from functools import lru_cache
+from itertools import accumulate
+from array import array
+from collections import OrderedDict
+from hashlib import blake2b
+from importlib.util import find_spec
+import httpx
+from openai import (
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    APIConnectionError,
+    APIStatusError,
+    AuthenticationError,
+    InternalServerError,
+    PermissionDeniedError,
+    RateLimitError,
+)
 from ..core.config import get_settings
+import json
 import logging
+import numpy as np
 import asyncio
-from tenacity import retry, stop_after_attempt, wait_exponential
+import random
+import threading
+import unicodedata
+from aiolimiter import AsyncLimiter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to character-based truncation
+    tiktoken = None
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib JSON parser
+    orjson = None
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -12,159 +44,428 @@ logger = logging.getLogger(__name__)
 EMBEDDING_TIMEOUT = 30  # 30 seconds timeout for embedding generation
 MAX_RETRIES = 3
 INITIAL_WAIT = 1  # Initial wait time between retries in seconds
+EMBEDDING_ENCODING = "cl100k_base"  # Tokenizer used by OpenAI embedding models
+EMBEDDING_BATCH_SIZE = 2048  # Maximum texts per embeddings API request
+MAX_TOKENS_PER_REQUEST = 300_000  # Maximum total input tokens per embeddings API request
+EMBEDDING_CACHE_SIZE = 4096  # Embeddings kept in memory for repeated texts
+
+# Transient API failures worth retrying; bad keys and bad requests fail immediately
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# HTTP/2 multiplexes concurrent requests over one connection when h2 is installed
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+# Bounds concurrent embeddings requests across all callers to respect rate limits
+_request_semaphore = asyncio.Semaphore(settings.OPENAI_CONCURRENCY)
+# Paces request starts to the account's requests-per-minute so bursts don't trigger 429s
+_request_limiter = AsyncLimiter(settings.OPENAI_RPM, 60)
+
+# Translation table mapping common typographic characters to ASCII equivalents
+_CHAR_REPLACEMENTS = str.maketrans({
+    '\u201c': '"',  # Smart quotes
+    '\u201d': '"',
+    '\u2018': "'",  # Smart apostrophes
+    '\u2019': "'",
+    '\u2013': '-',  # En dash
+    '\u2014': '-',  # Em dash
+    '\u2026': '...',  # Ellipsis
+    '\u200b': '',  # Zero-width space
+    '\xa0': ' ',  # Non-breaking space
+})
+
+# Embeddings of recently used texts, keyed by (text digest, model); least recently used evicted first
+_embedding_cache: "OrderedDict[Tuple[bytes, str], array]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+def _cache_key(text: str) -> Tuple[bytes, str]:
+    """Build the embedding cache key for already-prepared text."""
+    return blake2b(text.encode('utf-8'), digest_size=16).digest(), settings.EMBEDDING_MODEL
+
+def _get_cached_embedding(key: Tuple[bytes, str]) -> Optional[List[float]]:
+    """Return a copy of a cached embedding, or None on a miss."""
+    with _embedding_cache_lock:
+        cached = _embedding_cache.get(key)
+        if cached is not None:
+            _embedding_cache.move_to_end(key)
+    return list(cached) if cached is not None else None
+
+def _cache_embedding(key: Tuple[bytes, str], embedding: List[float]) -> None:
+    """Store an embedding compactly, evicting the oldest entries past the cap."""
+    with _embedding_cache_lock:
+        _embedding_cache[key] = array('d', embedding)
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+@lru_cache(maxsize=4)
+def _get_encoding(name: str):
+    """Load a tiktoken encoding once; building the BPE ranks is expensive."""
+    return tiktoken.get_encoding(name)
+
+def parse_embedding(value) -> List[float]:
+    """
+    Decode an embedding read from Supabase.
+
+    pgvector columns arrive as '[x,y,...]' text (valid JSON), bytea columns
+    written by pack_embedding as '\\x' hex, and JSON columns already decoded.
+    """
+    if isinstance(value, str):
+        if value.startswith('\\x'):
+            return np.frombuffer(bytes.fromhex(value[2:]), dtype='<f4').tolist()
+        return orjson.loads(value) if orjson is not None else json.loads(value)
+    return value
+
+def pack_embedding(embedding: List[float]) -> str:
+    """Encode an embedding as little-endian float32 bytes for a bytea column."""
+    # PostgREST accepts and returns bytea as '\\x'-prefixed hex: ~12 KB for
+    # 1536 dimensions instead of ~30 KB of JSON number text
+    return '\\x' + np.asarray(embedding, dtype='<f4').tobytes().hex()
+
+def normalize_embedding(embedding: List[float]) -> List[float]:
+    """Scale an embedding to unit length so cosine similarity is a plain dot product."""
+    vector = np.asarray(embedding, dtype=np.float64)
+    norm = np.linalg.norm(vector)
+    return (vector / norm).tolist() if norm > 0 else list(embedding)
+
+def token_offsets(text: str) -> Optional[List[int]]:
+    """
+    Return the character offset at which each embedding token of the text starts.
+
+    Returns None when tiktoken is unavailable, so callers can fall back to
+    measuring text in characters.
+    """
+    if tiktoken is None:
+        return None
+    encoding = _get_encoding(EMBEDDING_ENCODING)
+    tokens = encoding.encode(text, disallowed_special=())
+    if text.isascii():
+        # One byte per character, so offsets are the running token lengths
+        return list(accumulate(map(len, encoding.decode_tokens_bytes(tokens)), initial=0))[:-1]
+    decoded, offsets = encoding.decode_with_offsets(tokens)
+    return offsets if decoded == text else None
+
+# Most API keys kept with a live client; keys are user supplied, so bound them
+OPENAI_CLIENT_CACHE_SIZE = 16
+# Seconds an evicted client stays open so requests already using it, retries
+# included, can finish
+OPENAI_CLIENT_CLOSE_DELAY = 300
+
+async def _close_client_later(client: AsyncOpenAI) -> None:
+    """Close an evicted client's connection pool once its requests are done."""
+    await asyncio.sleep(OPENAI_CLIENT_CLOSE_DELAY)
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"Error closing evicted OpenAI client: {str(e)}")
 
 class OpenAIClient:
-    _instance: Optional[OpenAI] = None
-    _api_key: Optional[str] = None
+    # One client per API key so alternating keys keeps each connection pool
+    # alive, least recently used first
+    _clients: "OrderedDict[str, AsyncOpenAI]" = OrderedDict()
+    _closing: Set[asyncio.Task] = set()
+    _lock = threading.Lock()
+
+    @classmethod
+    def _evict(cls) -> None:
+        """Drop the least recently used clients beyond OPENAI_CLIENT_CACHE_SIZE (lock held)."""
+        while len(cls._clients) > OPENAI_CLIENT_CACHE_SIZE:
+            _, evicted = cls._clients.popitem(last=False)
+            try:
+                task = asyncio.get_running_loop().create_task(_close_client_later(evicted))
+            except RuntimeError:
+                # No event loop to close it on; its pool is freed with the client
+                continue
+            # Hold a reference so the task isn't garbage collected mid-sleep
+            cls._closing.add(task)
+            task.add_done_callback(cls._closing.discard)
 
     @classmethod
-    def get_client(cls, api_key: Optional[str] = None) -> OpenAI:
+    def get_client(cls, api_key: Optional[str] = None) -> AsyncOpenAI:
         """Get or create OpenAI client instance."""
+        key = api_key or settings.OPENAI_API_KEY
         try:
-            if api_key and (cls._instance is None or api_key != cls._api_key):
-                logger.info("Creating new OpenAI client with provided API key")
-                cls._instance = OpenAI(api_key=api_key, timeout=EMBEDDING_TIMEOUT)
-                cls._api_key = api_key
-            elif cls._instance is None:
-                logger.info("Creating new OpenAI client with settings API key")
-                cls._instance = OpenAI(api_key=settings.OPENAI_API_KEY, timeout=EMBEDDING_TIMEOUT)
-                cls._api_key = settings.OPENAI_API_KEY
-            return cls._instance
+            with cls._lock:
+                client = cls._clients.get(key)
+                if client is not None:
+                    cls._clients.move_to_end(key)
+                else:
+                    if api_key:
+                        logger.info("Creating new OpenAI client with provided API key")
+                    else:
+                        logger.info("Creating new OpenAI client with settings API key")
+                    # Keep enough warm connections for every concurrent request
+                    http_client = DefaultAsyncHttpxClient(
+                        http2=HTTP2_AVAILABLE,
+                        limits=httpx.Limits(
+                            max_connections=settings.OPENAI_CONCURRENCY * 2,
+                            max_keepalive_connections=settings.OPENAI_CONCURRENCY
+                        ),
+                        timeout=EMBEDDING_TIMEOUT
+                    )
+                    # Retries are handled by tenacity around _request_embeddings
+                    client = AsyncOpenAI(
+                        api_key=key,
+                        timeout=EMBEDDING_TIMEOUT,
+                        max_retries=0,
+                        http_client=http_client
+                    )
+                    cls._clients[key] = client
+                    cls._evict()
+            return client
         except Exception as e:
             logger.error(f"Error creating OpenAI client: {str(e)}")
             raise
 
-@retry(stop=stop_after_attempt(MAX_RETRIES), 
-       wait=wait_exponential(multiplier=INITIAL_WAIT, min=1, max=10))
-def generate_embedding(text: str, api_key: Optional[str] = None) -> List[float]:
+def _prepare_text(text: str) -> Tuple[str, int]:
     """
-    Generate an embedding for the given text using OpenAI's API.
-    
+    Sanitize and truncate text so it can be sent to the embeddings API.
+
     Args:
         text: The input text to embed
-        api_key: Optional API key (will use settings if not provided)
-    
+
     Returns:
-        List[float]: The embedding vector
+        Tuple[str, int]: ASCII-normalized text within the model's token limit,
+        and its token count (estimated when tiktoken is unavailable)
     """
-    try:
-        # Input validation and sanitization
-        if not text or not text.strip():
-            logger.warning("Empty or whitespace-only text received")
-            raise ValueError("Cannot generate embedding for empty text")
+    # Input validation and sanitization
+    if not text or not text.strip():
+        logger.warning("Empty or whitespace-only text received")
+        raise ValueError("Cannot generate embedding for empty text")
 
-        # Log the first and last few characters of the text for debugging
+    # Log the first and last few characters of the text for debugging; skip
+    # building the preview and character set entirely when debug logging is off
+    if logger.isEnabledFor(logging.DEBUG):
         text_preview = f"{text[:50]}...{text[-50:]}" if len(text) > 100 else text
-        logger.info(f"Generating embedding for text preview: {text_preview}")
-        logger.debug(f"Text length: {len(text)}, Character types: {set(text[:100])}")
-        
-        # Sanitize text - handle non-ASCII characters
-        sanitized_text = text
+        logger.debug("Generating embedding for text preview: %s", text_preview)
+        logger.debug("Text length: %d, Character types: %s", len(text), set(text[:100]))
+    
+    # Sanitize text - handle non-ASCII characters
+    sanitized_text = text
+    
+    # Check for and handle non-ASCII characters
+    if not text[:100].isascii():
+        logger.debug("Text contains non-ASCII characters, applying sanitization")
+        # Replace common smart quotes and special characters with ASCII equivalents
+        sanitized_text = sanitized_text.translate(_CHAR_REPLACEMENTS)
         
-        # Check for and handle non-ASCII characters
-        if any(ord(c) > 127 for c in text[:100]):
-            logger.info("Text contains non-ASCII characters, applying sanitization")
-            # Replace common smart quotes and special characters with ASCII equivalents
-            char_replacements = {
-                '"': '"',  # Smart quotes
-                '"': '"',
-                ''': "'",  # Smart apostrophes
-                ''': "'",
-                '–': '-',  # En dash
-                '—': '-',  # Em dash
-                '…': '...',  # Ellipsis
-                '\u200b': '',  # Zero-width space
-                '\xa0': ' ',  # Non-breaking space
-            }
-            
-            # Apply character replacements
-            for old, new in char_replacements.items():
-                sanitized_text = sanitized_text.replace(old, new)
-            
-            # For any remaining non-ASCII characters, try to normalize them
-            import unicodedata
+        # For any remaining non-ASCII characters, try to normalize them
+        if not sanitized_text.isascii():
             sanitized_text = unicodedata.normalize('NFKD', sanitized_text).encode('ascii', 'ignore').decode('ascii')
-            
-            logger.info("Text sanitization complete")
-        
-        client = OpenAIClient.get_client(api_key)
         
-        # Further sanitize and truncate text
-        # Replace problematic characters and normalize whitespace
+        logger.debug("Text sanitization complete")
+    
+    # Further sanitize and truncate text
+    # Replace problematic characters and normalize whitespace. isprintable() is
+    # False for NUL and any whitespace other than a plain space, so already
+    # normalized text (e.g. single-line queries) skips the split/join
+    if (not sanitized_text.isprintable() or '  ' in sanitized_text
+            or sanitized_text[:1] == ' ' or sanitized_text[-1:] == ' '):
         sanitized_text = ' '.join(sanitized_text.replace('\x00', ' ').split())
+    
+    # Use tiktoken to count tokens and ensure we're under the limit
+    if tiktoken is not None:
+        encoding = _get_encoding(EMBEDDING_ENCODING)
+        tokens = encoding.encode(sanitized_text)
         
-        # Use tiktoken to count tokens and ensure we're under the limit
-        # Import here to avoid circular imports
-        try:
-            import tiktoken
-            # Map model names consistently
-            model_name = settings.EMBEDDING_MODEL.lower()
-            encoding_model = "cl100k_base"  # Default for embedding models
-            
-            # Specific model mappings if needed
-            if "text-embedding-ada" in model_name:
-                encoding_model = "cl100k_base"
-            
-            encoding = tiktoken.get_encoding(encoding_model)
-            tokens = encoding.encode(sanitized_text)
-            
-            # Ada embedding model has an 8191 token limit
-            if len(tokens) > 8191:
-                logger.warning(f"Text has {len(tokens)} tokens, exceeding the limit. Truncating.")
-                truncated_tokens = tokens[:8191]
-                truncated_text = encoding.decode(truncated_tokens)
-                logger.info(f"Truncated from {len(tokens)} to {len(truncated_tokens)} tokens")
-            else:
-                truncated_text = sanitized_text
-                logger.info(f"Text has {len(tokens)} tokens, under the 8191 limit.")
-        except ImportError:
-            # Fallback to character-based truncation if tiktoken is not available
-            logger.warning("tiktoken not available, using character-based truncation")
-            truncated_text = sanitized_text[:8000]  # Conservative character limit
-            if len(sanitized_text) > 8000:
-                logger.warning(f"Text truncated from {len(sanitized_text)} to 8000 characters")
+        # Ada embedding model has an 8191 token limit
+        if len(tokens) > 8191:
+            logger.warning("Text has %d tokens, exceeding the limit. Truncating.", len(tokens))
+            truncated_tokens = tokens[:8191]
+            truncated_text = encoding.decode(truncated_tokens)
+            token_count = len(truncated_tokens)
+            logger.info("Truncated from %d to %d tokens", len(tokens), len(truncated_tokens))
+        else:
+            truncated_text = sanitized_text
+            token_count = len(tokens)
+            logger.debug("Text has %d tokens, under the 8191 limit.", len(tokens))
+    else:
+        # Fallback to character-based truncation if tiktoken is not available
+        logger.warning("tiktoken not available, using character-based truncation")
+        truncated_text = sanitized_text[:8000]  # Conservative character limit
+        if len(sanitized_text) > 8000:
+            logger.warning("Text truncated from %d to 8000 characters", len(sanitized_text))
+        # Conservative estimate so request token budgets are never exceeded
+        token_count = len(truncated_text) // 2 + 1
+    
+    if not truncated_text.strip():
+        logger.error("Text became empty after sanitization")
+        raise ValueError("Text became empty after sanitization")
+
+    return truncated_text, token_count
+
+def _plan_batches(indices: List[int], token_counts: List[int], batch_size: int) -> List[List[int]]:
+    """Group text indices into requests within the per-request input and token limits."""
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_tokens = 0
+    for i in indices:
+        if batch and (len(batch) >= batch_size or batch_tokens + token_counts[i] > MAX_TOKENS_PER_REQUEST):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += token_counts[i]
+    if batch:
+        batches.append(batch)
+    return batches
+
+_backoff = wait_exponential_jitter(initial=INITIAL_WAIT, max=10)
+
+def _retry_after(error: RateLimitError) -> Optional[float]:
+    """Seconds the server asked us to wait before retrying, if it said."""
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def _retry_wait(retry_state) -> float:
+    """Wait as long as a 429's Retry-After asks, otherwise back off with jitter."""
+    error = retry_state.outcome.exception()
+    if isinstance(error, RateLimitError):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            # Small jitter so batches rejected together don't all return at once
+            return min(retry_after, 60.0) + random.uniform(0, 0.5)
+    return _backoff(retry_state)
+
+@retry(retry=retry_if_exception_type(RETRYABLE_ERRORS),
+       stop=stop_after_attempt(MAX_RETRIES),
+       wait=_retry_wait,
+       reraise=True)
+async def _request_embeddings(client: AsyncOpenAI, batch: List[str]):
+    """Call the embeddings API for one batch, retrying transient failures."""
+    async with _request_semaphore, _request_limiter:
+        return await client.embeddings.create(
+            model=settings.EMBEDDING_MODEL,
+            input=batch
+        )
+
+async def generate_embeddings(
+    texts: List[str],
+    api_key: Optional[str] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    skip_invalid: bool = False
+) -> List[Optional[List[float]]]:
+    """
+    Generate embeddings for several texts, sending them to OpenAI in batches.
+    
+    Args:
+        texts: The input texts to embed
+        api_key: Optional API key (will use settings if not provided)
+        batch_size: Maximum number of texts per API request
+        skip_invalid: Return None for texts that are empty after sanitization
+            instead of failing the whole call
+    
+    Returns:
+        List[Optional[List[float]]]: One embedding vector per input text, in input order
+    """
+    try:
+        prepared_texts: List[Optional[str]] = []
+        token_counts: List[int] = []
+        for text in texts:
+            try:
+                prepared, token_count = _prepare_text(text)
+            except ValueError:
+                if not skip_invalid:
+                    raise
+                prepared, token_count = None, 0
+            prepared_texts.append(prepared)
+            token_counts.append(token_count)
+        cache_keys = [_cache_key(text) if text is not None else None for text in prepared_texts]
         
-        if not truncated_text.strip():
-            logger.error("Text became empty after sanitization")
-            raise ValueError("Text became empty after sanitization")
+        # Identical texts map to identical vectors, so only embed cache misses
+        embeddings: List[Optional[List[float]]] = [
+            _get_cached_embedding(key) if key is not None else None for key in cache_keys
+        ]
+        cache_hits = sum(embedding is not None for embedding in embeddings)
+        missing = [
+            i for i, embedding in enumerate(embeddings)
+            if embedding is None and prepared_texts[i] is not None
+        ]
+        # Repeated texts within the call (boilerplate, headers) are embedded once
+        first_index: Dict[Tuple[bytes, str], int] = {}
+        for i in missing:
+            first_index.setdefault(cache_keys[i], i)
+        unique_missing = list(first_index.values())
+        if not missing:
+            logger.debug("All %d embeddings served from cache", cache_hits)
+            return embeddings
         
-        logger.info(f"Using embedding model: {settings.EMBEDDING_MODEL}")
-        logger.debug("Making API call to OpenAI")
+        client = OpenAIClient.get_client(api_key)
         
-        try:
-            response = client.embeddings.create(
-                model=settings.EMBEDDING_MODEL,
-                input=truncated_text
-            )
+        logger.debug("Using embedding model: %s", settings.EMBEDDING_MODEL)
+        
+        async def embed_batch(batch_indices: List[int]) -> None:
+            batch = [prepared_texts[i] for i in batch_indices]
+            logger.debug("Making API call to OpenAI for %d texts", len(batch))
             
-            if not response or not response.data:
-                logger.error("Empty response from OpenAI API")
-                raise ValueError("Empty response from OpenAI API")
+            try:
+                response = await _request_embeddings(client, batch)
                 
-            embedding = response.data[0].embedding
-            embedding_length = len(embedding)
-            logger.info(f"Successfully generated embedding of dimension {embedding_length}")
-            
-            # Validate embedding
-            if not embedding_length > 0:
-                raise ValueError(f"Invalid embedding dimension: {embedding_length}")
+                if not response or not response.data:
+                    logger.error("Empty response from OpenAI API")
+                    raise ValueError("Empty response from OpenAI API")
                 
-            return embedding
-            
-        except asyncio.TimeoutError:
-            logger.error("Embedding generation timed out")
-            raise ValueError("Embedding generation timed out. Please try again.")
+                if len(response.data) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} embeddings, received {len(response.data)}")
+                
+                # Results carry the index of their input; keep input order
+                for i, item in zip(batch_indices, sorted(response.data, key=lambda d: d.index)):
+                    embedding = item.embedding
+                    # Validate embedding
+                    if not len(embedding) > 0:
+                        raise ValueError(f"Invalid embedding dimension: {len(embedding)}")
+                    embeddings[i] = embedding
+                    _cache_embedding(cache_keys[i], embedding)
+                
+            except asyncio.TimeoutError:
+                logger.error("Embedding generation timed out")
+                raise ValueError("Embedding generation timed out. Please try again.")
+        
+        # Send all batches at once; _request_semaphore caps how many are in flight.
+        # Let every batch finish so successful ones are cached before raising
+        results = await asyncio.gather(
+            *(embed_batch(batch_indices) for batch_indices in _plan_batches(unique_missing, token_counts, batch_size)),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        
+        for i in missing:
+            if embeddings[i] is None:
+                embeddings[i] = list(embeddings[first_index[cache_keys[i]]])
+        
+        # Repeats of a text embedded in this call are neither generated nor cache hits
+        logger.info("Successfully generated %d embeddings (%d cached, %d repeated)",
+                    len(unique_missing), cache_hits, len(missing) - len(unique_missing))
+        return embeddings
             
+    except (AuthenticationError, PermissionDeniedError):
+        logger.error("OpenAI API authentication failed")
+        raise ValueError('Invalid OpenAI API key. Please check your settings.')
+    except RateLimitError:
+        logger.error("OpenAI API rate limit exceeded")
+        raise ValueError('OpenAI rate limit exceeded. Please try again later.')
+    except APIStatusError as e:
+        logger.error(f"OpenAI API error (status {e.status_code}): {str(e)}")
+        raise
     except Exception as e:
-        if hasattr(e, 'status_code'):
-            if e.status_code == 403:
-                logger.error("OpenAI API authentication failed")
-                raise ValueError('Invalid OpenAI API key. Please check your settings.')
-            elif e.status_code == 429:
-                logger.error("OpenAI API rate limit exceeded")
-                raise ValueError('OpenAI rate limit exceeded. Please try again later.')
-            else:
-                logger.error(f"OpenAI API error (status {e.status_code}): {str(e)}")
-        else:
-            logger.error(f"Error generating embedding: {str(e)}", exc_info=True)
-        raise 
\ No newline at end of file
+        logger.error(f"Error generating embedding: {str(e)}", exc_info=True)
+        raise
+
+async def generate_embedding(text: str, api_key: Optional[str] = None) -> List[float]:
+    """
+    Generate an embedding for the given text using OpenAI's API.
+    
+    Args:
+        text: The input text to embed
+        api_key: Optional API key (will use settings if not provided)
+    
+    Returns:
+        List[float]: The embedding vector
+    """
+    embeddings = await generate_embeddings([text], api_key)
+    return embeddings[0]
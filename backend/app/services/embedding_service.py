@@ -1,100 +1,175 @@
-from typing import List, Optional
-from supabase import Client, create_client
-from .embedding_helper import generate_embedding
+from typing import Dict, List, Optional, Tuple
+from supabase import Client
+from .embedding_helper import generate_embeddings, normalize_embedding, pack_embedding, parse_embedding, token_offsets
 from ..core.config import get_settings
+from ..core.clients import get_supabase, run_supabase
 from ..models.file import EmbeddingCreate, EmbeddingDB
 import logging
+import asyncio
 from datetime import datetime
 from uuid import UUID, uuid4
-import json
+import hashlib
+import re
+from bisect import bisect_right
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+INSERT_BATCH_SIZE = 500  # Embedding rows per Supabase insert (~30 KB each), bounded by request body size
+CACHE_LOOKUP_BATCH_SIZE = 100  # Hashes per embedding_cache query, keeps the URL short
+THREADED_CHUNKING_MIN_LENGTH = 200_000  # Texts at least this long are chunked off the event loop
+
+# Chunk break points, most natural first; lookaheads so overlapping matches are found
+_SEPARATOR_PATTERNS = [
+    (separator, re.compile(f'(?={re.escape(separator)})'))
+    for separator in ('\n\n', '\n', '. ', ' ')
+]
+
 class EmbeddingService:
     def __init__(self, supabase_client: Optional[Client] = None):
         """Initialize the embedding service."""
-        self.supabase = supabase_client or create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_KEY
-        )
+        self.supabase = supabase_client or get_supabase()
 
-    def chunk_text(self, text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
-        """Split text into overlapping chunks to maintain context."""
-        chunk_size = chunk_size or settings.CHUNK_SIZE
-        overlap = overlap or settings.CHUNK_OVERLAP
+    def _lookup_cache(self, hashes: List[str], model: str) -> Dict[str, List[float]]:
+        """Fetch cached embeddings for the given content hashes."""
+        cached = {}
+        try:
+            for batch_start in range(0, len(hashes), CACHE_LOOKUP_BATCH_SIZE):
+                batch = hashes[batch_start:batch_start + CACHE_LOOKUP_BATCH_SIZE]
+                response = self.supabase.table('embedding_cache')\
+                    .select('hash,embedding')\
+                    .in_('hash', batch)\
+                    .eq('model', model)\
+                    .execute()
+                for item in response.data:
+                    cached[item['hash']] = parse_embedding(item['embedding'])
+        except Exception as e:
+            # The cache is an optimization; embed everything if it is unavailable
+            logger.warning(f"Embedding cache lookup failed: {str(e)}")
+        return cached
+
+    def _store_cache(self, embeddings_by_hash: Dict[str, List[float]], model: str) -> None:
+        """Save freshly generated embeddings to the cache."""
+        if not embeddings_by_hash:
+            return
+        try:
+            self.supabase.table('embedding_cache').upsert([
+                {'hash': content_hash, 'model': model, 'embedding': pack_embedding(embedding)}
+                for content_hash, embedding in embeddings_by_hash.items()
+            ], returning='minimal').execute()
+        except Exception as e:
+            logger.warning(f"Failed to update embedding cache: {str(e)}")
+
+    def _insert_batch(self, batch: List[Dict]) -> List[Dict]:
+        """Insert one batch of embedding rows and return their ids and chunk indexes."""
+        query = self.supabase.table('embeddings').insert(batch)
+        # Only the generated ids are needed back; without a select PostgREST
+        # echoes every inserted vector in the response
+        query.params = query.params.set('select', 'id,chunk_index')
+        response = query.execute()
         
+        if hasattr(response, 'error') and response.error:
+            raise Exception(f"Error saving embeddings batch: {response.error}")
+        return response.data
+
+    def chunk_offsets(self, text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Find the (start, end) character spans of overlapping chunks of the text,
+        with surrounding whitespace excluded.
+
+        Sizes are measured in embedding tokens, or in characters when tiktoken
+        is not installed.
+        """
         if not text.strip():
             logger.warning("Empty text received for chunking")
             return []
         
+        # Character offset where each unit (token or character) starts
+        offsets = token_offsets(text)
+        if offsets is not None:
+            chunk_size = chunk_size or settings.CHUNK_SIZE_TOKENS
+            overlap = overlap or settings.CHUNK_OVERLAP_TOKENS
+            unit = "tokens"
+        else:
+            offsets = range(len(text))
+            chunk_size = chunk_size or settings.CHUNK_SIZE
+            overlap = overlap or settings.CHUNK_OVERLAP
+            unit = "characters"
+        
+        def offset_after(position: int, count: int) -> int:
+            """Character offset `count` units after the unit containing `position`."""
+            index = bisect_right(offsets, position) - 1 + count
+            return offsets[max(index, 0)] if index < len(offsets) else len(text)
+        
         # Log text statistics
-        logger.info(f"Chunking text of length {len(text)} with chunk_size={chunk_size}, overlap={overlap}")
-        logger.debug(f"Text preview: {text[:100]}...")
+        logger.info("Chunking text of length %d (%d %s) with chunk_size=%d, overlap=%d",
+                    len(text), len(offsets), unit, chunk_size, overlap)
         
         # Check for potential issues
-        non_ascii = sum(1 for c in text if ord(c) > 127)
-        if non_ascii > 0:
-            logger.warning(f"Text contains {non_ascii} non-ASCII characters")
+        if not text.isascii():
+            logger.warning("Text contains non-ASCII characters")
         
-        chunks = []
-        start = 0
-        last_start = -1  # Track last starting position to detect infinite loops
-        max_iterations = (len(text) // (chunk_size - overlap)) + 2  # Maximum possible chunks plus safety margin
-        iteration = 0
+        # Positions of each separator, found with one regex pass the first time that
+        # separator is needed; word breaks (the longest list) are rarely reached
+        separator_positions: Dict[str, List[int]] = {}
         
-        while start < len(text) and iteration < max_iterations:
-            iteration += 1
-            logger.debug(f"Chunk iteration {iteration}, start position: {start}")
+        def positions_of(separator: str, pattern: re.Pattern) -> List[int]:
+            positions = separator_positions.get(separator)
+            if positions is None:
+                positions = separator_positions[separator] = [match.start() for match in pattern.finditer(text)]
+            return positions
+        
+        spans = []
+        hard_breaks = 0
+        start = 0
+        while start < len(text):
+            # Ensure end doesn't exceed text length
+            end = offset_after(start, chunk_size)
             
-            # Detect infinite loop
-            if start == last_start:
-                logger.error(f"Infinite loop detected at position {start}")
-                break
-            last_start = start
+            # If we're not at the end of the text, break at the last paragraph,
+            # line, sentence or word boundary that fits in the chunk, in that order.
+            # Breaks inside the overlap are skipped since the next chunk could not advance
+            if end < len(text):
+                min_end = offset_after(start, overlap)
+                for separator, pattern in _SEPARATOR_PATTERNS:
+                    separator_length = len(separator)
+                    positions = positions_of(separator, pattern)
+                    index = bisect_right(positions, end - separator_length) - 1
+                    if index >= 0 and positions[index] + separator_length > min_end:
+                        end = positions[index] + separator_length
+                        break
+                else:
+                    hard_breaks += 1
             
-            try:
-                # Ensure end doesn't exceed text length
-                end = min(start + chunk_size, len(text))
-                
-                # If we're not at the end of the text, try to find a good break point
-                if end < len(text):
-                    # Try to break at paragraph or sentence
-                    break_found = False
-                    for separator in ['\n\n', '\n', '. ', ' ']:
-                        pos = text[start:end].rfind(separator)
-                        if pos != -1:
-                            end = start + pos + len(separator)
-                            break_found = True
-                            break
-                    
-                    if not break_found:
-                        logger.warning(f"No natural break found in chunk at position {start}, using hard break")
-                
-                chunk = text[start:end].strip()
-                
-                # Validate chunk
-                if chunk:
-                    if len(chunk) < 10:  # Very small chunks might indicate issues
-                        logger.warning(f"Very small chunk ({len(chunk)} chars) at position {start}: {chunk}")
-                    chunks.append(chunk)
-                    logger.debug(f"Created chunk {len(chunks)}: {chunk[:50]}...")
-                
-                # Ensure we're making forward progress
-                new_start = end - overlap
-                if new_start <= start:
-                    logger.warning(f"No forward progress at position {start}, forcing advancement")
-                    new_start = start + 1
-                start = new_start
-                
-            except Exception as e:
-                logger.error(f"Error processing chunk at position {start}: {str(e)}")
-                # Force advancement to prevent getting stuck
-                start += chunk_size // 2
+            # Trim surrounding whitespace by moving the bounds instead of slicing
+            chunk_start, chunk_end = start, end
+            while chunk_start < chunk_end and text[chunk_start].isspace():
+                chunk_start += 1
+            while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+                chunk_end -= 1
+            # A break just past the previous chunk can leave nothing new but
+            # whitespace; such a chunk would only repeat the previous one
+            if chunk_end > chunk_start and not (spans and chunk_end <= spans[-1][1]):
+                if chunk_end - chunk_start < 10:  # Very small chunks might indicate issues
+                    logger.warning("Very small chunk (%d chars) at position %d: %s",
+                                   chunk_end - chunk_start, start, text[chunk_start:chunk_end])
+                spans.append((chunk_start, chunk_end))
+            
+            if end >= len(text):
+                break
+            # Ensure we're making forward progress even if overlap >= chunk_size
+            start = max(offset_after(end, -overlap), start + 1)
         
-        # Check if we hit the iteration limit
-        if iteration >= max_iterations:
-            logger.warning(f"Hit maximum iterations ({max_iterations}) during chunking")
+        # One summary instead of a warning per chunk
+        if hard_breaks:
+            logger.warning("No natural break found for %d chunks, used hard breaks", hard_breaks)
+        
+        return spans
+
+    def chunk_text(self, text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
+        """Split text into overlapping chunks to maintain context."""
+        # Only the final chunks are materialized as strings
+        chunks = [text[start:end] for start, end in self.chunk_offsets(text, chunk_size, overlap)]
         
         # Final validation
         if len(chunks) == 0:
@@ -120,14 +195,19 @@ class EmbeddingService:
             
             # Log file details
             logger.info(f"Starting embedding generation for file {file_id}")
-            logger.info(f"Text length: {len(text)}, First 100 chars: {text[:100]}")
+            logger.debug("Text length: %d, First 100 chars: %s", len(text), text[:100])
             
             # Convert string IDs to UUIDs
             file_uuid = UUID(file_id)
             user_uuid = UUID(user_id)
             
             # Split text into chunks
-            chunks = self.chunk_text(text)
+            # Tokenizing a large document takes long enough to stall other requests,
+            # so do it in a worker thread (tiktoken releases the GIL while encoding)
+            if len(text) >= THREADED_CHUNKING_MIN_LENGTH:
+                chunks = await asyncio.to_thread(self.chunk_text, text)
+            else:
+                chunks = self.chunk_text(text)
             if not chunks:
                 raise ValueError("No valid chunks generated from text")
                 
@@ -137,77 +217,88 @@ class EmbeddingService:
             embedding_data_list = []
             chunk_errors = []
             
-            # Process chunks in smaller batches
-            BATCH_SIZE = 5
-            for batch_start in range(0, len(chunks), BATCH_SIZE):
-                batch_end = min(batch_start + BATCH_SIZE, len(chunks))
-                batch = chunks[batch_start:batch_end]
+            # Reuse embeddings of chunks seen before (e.g. re-indexing an unchanged note)
+            model = settings.EMBEDDING_MODEL
+            chunk_hashes = [hashlib.sha256(chunk.encode('utf-8')).hexdigest() for chunk in chunks]
+            cached = await run_supabase(self._lookup_cache, list(set(chunk_hashes)), model)
+            chunk_embeddings = [cached.get(content_hash) for content_hash in chunk_hashes]
+            missing = [i for i, embedding in enumerate(chunk_embeddings) if embedding is None]
+            logger.info(f"{len(chunks) - len(missing)}/{len(chunks)} chunk embeddings found in cache")
+            fresh_by_hash: Dict[str, List[float]] = {}
+            
+            if missing:
+                # Repeated chunks (boilerplate, headers) are embedded once and fanned out
+                positions_by_hash: Dict[str, List[int]] = {}
+                for i in missing:
+                    positions_by_hash.setdefault(chunk_hashes[i], []).append(i)
+                unique_hashes = list(positions_by_hash)
                 
-                logger.info(f"Processing batch {batch_start//BATCH_SIZE + 1} of {(len(chunks) + BATCH_SIZE - 1)//BATCH_SIZE}")
+                # Embed the remaining chunks in as few API requests as the limits allow
+                fresh = await generate_embeddings(
+                    [chunks[positions_by_hash[content_hash][0]] for content_hash in unique_hashes],
+                    api_key,
+                    skip_invalid=True
+                )
+                for content_hash, embedding in zip(unique_hashes, fresh):
+                    for i in positions_by_hash[content_hash]:
+                        chunk_embeddings[i] = embedding
+                    if embedding:
+                        fresh_by_hash[content_hash] = embedding
+            
+            created_at = datetime.utcnow().replace(microsecond=0)
+            for chunk_index, (chunk, embedding) in enumerate(zip(chunks, chunk_embeddings)):
+                if not embedding:
+                    error_msg = f"Invalid embedding generated for chunk {chunk_index}"
+                    logger.error(error_msg)
+                    chunk_errors.append(error_msg)
+                    continue
                 
-                for i, chunk in enumerate(batch):
-                    chunk_index = batch_start + i
-                    try:
-                        logger.info(f"Processing chunk {chunk_index + 1}/{len(chunks)}")
-                        logger.debug(f"Chunk preview: {chunk[:100]}...")
-                        
-                        # Generate embedding with timeout and retry
-                        embedding = generate_embedding(chunk, api_key)
-                        if not embedding or not isinstance(embedding, list):
-                            error_msg = f"Invalid embedding generated for chunk {chunk_index}"
-                            logger.error(error_msg)
-                            chunk_errors.append(error_msg)
-                            continue
-                        
-                        logger.info(f"Successfully generated embedding for chunk {chunk_index + 1}")
-                        
-                        # Prepare embedding data
-                        embedding_data = {
-                            'file_id': str(file_uuid),
-                            'user_id': str(user_uuid),
-                            'embedding': json.dumps(embedding),
-                            'text': chunk,
-                            'chunk_index': chunk_index,
-                            'created_at': datetime.utcnow().replace(microsecond=0).isoformat()
-                        }
-                        embedding_data_list.append(embedding_data)
-                        
-                    except Exception as chunk_error:
-                        error_msg = str(chunk_error)
-                        logger.error(f"Error processing chunk {chunk_index}: {error_msg}")
-                        chunk_errors.append(f"Chunk {chunk_index}: {error_msg}")
-                        continue
+                # Stored vectors are unit length so search can skip the norm division
+                embedding = chunk_embeddings[chunk_index] = normalize_embedding(embedding)
                 
-                # Save batch to database if we have any successful embeddings
-                if embedding_data_list:
-                    try:
-                        logger.info(f"Saving batch of {len(embedding_data_list)} embeddings to database")
-                        response = self.supabase.table('embeddings').insert(embedding_data_list).execute()
-                        
-                        if hasattr(response, 'error') and response.error:
-                            logger.error(f"Error saving embeddings batch: {response.error}")
-                            chunk_errors.append(f"Failed to save batch starting at chunk {batch_start}")
-                        else:
-                            # Create EmbeddingDB instances for successful saves
-                            for item in response.data:
-                                embedding_db = EmbeddingDB(
-                                    id=item['id'],
-                                    file_id=file_uuid,
-                                    user_id=user_uuid,
-                                    embedding=json.loads(item['embedding']),
-                                    text=item['text'],
-                                    chunk_index=item['chunk_index'],
-                                    created_at=datetime.fromisoformat(item['created_at'].replace('T', ' '))
-                                )
-                                embeddings.append(embedding_db)
-                                
-                            logger.info(f"Successfully saved batch of {len(response.data)} embeddings")
-                    except Exception as save_error:
-                        logger.error(f"Error saving batch: {str(save_error)}")
-                        chunk_errors.append(f"Failed to save batch starting at chunk {batch_start}")
+                # Prepare embedding data
+                embedding_data_list.append({
+                    'file_id': str(file_uuid),
+                    'user_id': str(user_uuid),
+                    'embedding': embedding,  # halfvec column; PostgREST casts the JSON array
+                    'text': chunk,
+                    'chunk_index': chunk_index,
+                    'created_at': created_at.isoformat()
+                })
+            
+            # Save to database in batches to keep request payloads bounded. Each
+            # request blocks, so run the inserts and the cache update side by
+            # side in worker threads instead of one after another on the event loop
+            batches = [
+                embedding_data_list[batch_start:batch_start + INSERT_BATCH_SIZE]
+                for batch_start in range(0, len(embedding_data_list), INSERT_BATCH_SIZE)
+            ]
+            logger.info(f"Saving {len(embedding_data_list)} embeddings to database in {len(batches)} batches")
+            results = await asyncio.gather(
+                *(run_supabase(self._insert_batch, batch) for batch in batches),
+                run_supabase(self._store_cache, fresh_by_hash, model),
+                return_exceptions=True
+            )
+            for batch, result in zip(batches, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"Error saving batch: {str(result)}")
+                    chunk_errors.append(f"Failed to save batch starting at chunk {batch[0]['chunk_index']}")
+                    continue
                 
-                # Clear batch list for next iteration
-                embedding_data_list = []
+                # Create EmbeddingDB instances for successful saves from the data we sent
+                for item in result:
+                    embedding_db = EmbeddingDB(
+                        id=item['id'],
+                        file_id=file_uuid,
+                        user_id=user_uuid,
+                        embedding=chunk_embeddings[item['chunk_index']],
+                        text=chunks[item['chunk_index']],
+                        chunk_index=item['chunk_index'],
+                        created_at=created_at
+                    )
+                    embeddings.append(embedding_db)
+                    
+                logger.info(f"Successfully saved batch of {len(result)} embeddings")
             
             # Log summary
             total_chunks = len(chunks)
@@ -244,7 +335,7 @@ class EmbeddingService:
                     id=item['id'],
                     file_id=UUID(item['file_id']),
                     user_id=UUID(item['user_id']),
-                    embedding=json.loads(item['embedding']) if isinstance(item['embedding'], str) else item['embedding'],
+                    embedding=parse_embedding(item['embedding']),
                     text=item['text'],
                     chunk_index=item['chunk_index'],
                     created_at=datetime.fromisoformat(item['created_at'].replace('T', ' '))
@@ -1,60 +1,114 @@
-from typing import List, Optional
+from typing import List, Optional, Pattern, Sequence, Tuple, Union
+from collections import Counter, OrderedDict
+from hashlib import sha256
+import logging
 import math
-from .embedding_helper import generate_embedding
+import re
+import numpy as np
+from .embedding_helper import generate_embedding, generate_embeddings
 from ..models.search import LinkedContext, SearchResult
 from ..core.config import get_settings
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
-def cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
+Vector = Union[np.ndarray, Sequence[float]]
+
+# Obsidian-style [[path]] or [[path|alias]] links
+_LINK_RE = re.compile(r'\[\[(.*?)\]\]')
+# Everything extract_keywords strips before splitting into words
+_NONALNUM_RE = re.compile(r'[^a-zA-Z0-9\s]')
+
+_STOP_WORDS = frozenset({
+    'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or',
+    'but', 'in', 'to', 'for', 'with', 'by', 'from', 'up', 'about',
+    'into', 'over', 'after'
+})
+
+# Normalized query vectors, most recently used last; a few queries dominate traffic
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+_query_embedding_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+
+def cosine_similarity(vec_a: Vector, vec_b: Vector) -> float:
     """Calculate cosine similarity between two vectors."""
     try:
-        # Convert vectors to float if they aren't already
-        vec_a = [float(a) for a in vec_a]
-        vec_b = [float(b) for b in vec_b]
-        
-        dot_product = sum(a * b for a, b in zip(vec_a, vec_b))
-        magnitude_a = (sum(a * a for a in vec_a)) ** 0.5
-        magnitude_b = (sum(b * b for b in vec_b)) ** 0.5
-        
-        if magnitude_a == 0 or magnitude_b == 0:
+        # No copy when the caller already holds contiguous float32 arrays
+        vec_a = np.ascontiguousarray(vec_a, dtype=np.float32)
+        vec_b = np.ascontiguousarray(vec_b, dtype=np.float32)
+
+        dot_product = float(np.dot(vec_a, vec_b))
+        magnitude = math.sqrt(float(np.vdot(vec_a, vec_a)) * float(np.vdot(vec_b, vec_b)))
+
+        if magnitude == 0:
             return 0.0
-        
-        similarity = dot_product / (magnitude_a * magnitude_b)
+
+        similarity = dot_product / magnitude
         # Ensure score is between -1 and 1
         return max(min(similarity, 1.0), -1.0)
     except Exception as e:
-        print(f"Error in cosine similarity calculation: {e}")
+        logger.error(f"Error in cosine similarity calculation: {e}")
         return 0.0
 
+async def get_query_embedding(query: str, api_key: Optional[str] = None) -> np.ndarray:
+    """Return the unit-length float32 embedding of a search query, cached by query text."""
+    key = (settings.EMBEDDING_MODEL, sha256(query.strip().encode('utf-8')).hexdigest())
+    cached = _query_embedding_cache.get(key)
+    if cached is not None:
+        _query_embedding_cache.move_to_end(key)
+        return cached
+
+    query_vector = np.asarray(await generate_embedding(query, api_key), dtype=np.float32)
+    query_norm = np.linalg.norm(query_vector)
+    if query_norm > 0:
+        query_vector /= query_norm
+    # Shared between requests, so make sure no caller can modify it
+    query_vector.setflags(write=False)
+
+    _query_embedding_cache[key] = query_vector
+    while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+        _query_embedding_cache.popitem(last=False)
+    return query_vector
+
 def extract_keywords(text: str) -> List[str]:
     """Extract meaningful keywords from text."""
-    import re
-    # Use re.sub with a raw string pattern for proper escaping
-    cleaned_text = re.sub(r'[^a-zA-Z0-9\s]', '', text.lower())
+    cleaned_text = _NONALNUM_RE.sub('', text.lower())
     words = cleaned_text.split()
     words = [word for word in words if len(word) > 2]
     
-    stop_words = {
-        'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 
-        'but', 'in', 'to', 'for', 'with', 'by', 'from', 'up', 'about', 
-        'into', 'over', 'after'
-    }
-    
-    return [word for word in words if word not in stop_words]
+    return [word for word in words if word not in _STOP_WORDS]
+
+def compile_keyword_pattern(keywords: List[str]) -> Optional[Pattern[str]]:
+    """Compile a single whole-word pattern matching any of the keywords."""
+    if not keywords:
+        return None
+    # Longest first so a keyword is preferred over any of its prefixes
+    alternatives = sorted(set(keywords), key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(map(re.escape, alternatives)) + r')\b')
+
+def calculate_keyword_score(
+    content: str,
+    keywords: List[str],
+    pattern: Optional[Pattern[str]] = None,
+    content_lower: Optional[str] = None
+) -> float:
+    """
+    Calculate keyword-based relevance score.
+
+    Pass the result of compile_keyword_pattern(keywords) as pattern when
+    scoring many documents against the same keywords, and content.lower()
+    as content_lower when the caller already has it.
+    """
+    if pattern is None:
+        pattern = compile_keyword_pattern(keywords)
 
-def calculate_keyword_score(content: str, keywords: List[str]) -> float:
-    """Calculate keyword-based relevance score."""
-    import re
     score = 0
-    content_lower = content.lower()
-    
-    for keyword in keywords:
-        # Use word boundaries to match whole words only
-        pattern = fr'\b{re.escape(keyword)}\b'
-        matches = re.findall(pattern, content_lower)
-        if matches:
-            score += len(matches)
+    if pattern is not None:
+        # One scan over the content; a keyword repeated in the query counts
+        # once per repetition, as when each keyword was searched separately
+        weights = Counter(keywords)
+        score = sum(weights[match] for match in pattern.findall(
+            content_lower if content_lower is not None else content.lower()
+        ))
 
     # Normalize score by content length (per 100 characters)
     return score / (len(content) / 100)
@@ -65,14 +119,12 @@ def extract_relevant_section(content: str, max_length: int = 2000) -> str:
 
 async def get_linked_contexts(
     content: str,
-    query_embedding: List[float],
+    query_embedding: Vector,
     api_key: Optional[str] = None,
     similarity_threshold: Optional[float] = None
 ) -> List[LinkedContext]:
     """Extract and process linked contexts from content."""
-    import re
-    link_regex = r'\[\[(.*?)\]\]'
-    matches = list(re.finditer(link_regex, content))
+    matches = list(_LINK_RE.finditer(content))
     linked_contexts: List[LinkedContext] = []
     
     if not matches:
@@ -80,26 +132,34 @@ async def get_linked_contexts(
     
     similarity_threshold = similarity_threshold or settings.SIMILARITY_THRESHOLD
     
-    # Extract all paths
-    paths = [match.group(1).split('|')[0] for match in matches]
+    # Extract all paths; the same note is often linked more than once
+    paths = list(dict.fromkeys(match.group(1).split('|')[0] for match in matches))
     
     try:
-        # Generate one embedding for all paths combined
-        combined_text = " | ".join(paths)
-        combined_embedding = generate_embedding(combined_text, api_key)
+        # Embed every linked path in one request and score them all at once
+        path_embeddings = await generate_embeddings(paths, api_key, skip_invalid=True)
+        embedded = [i for i, embedding in enumerate(path_embeddings) if embedding]
+        if not embedded:
+            return []
+        
+        matrix = np.asarray([path_embeddings[i] for i in embedded], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector)
+        if query_norm > 0:
+            query_vector = query_vector / query_norm
+        scores = np.clip((matrix @ query_vector) / norms, -1.0, 1.0)
         
-        # Process each path with the combined embedding
-        for path in paths:
-            relevance = cosine_similarity(query_embedding, combined_embedding)
-            
-            if relevance >= similarity_threshold:
-                linked_contexts.append(
-                    LinkedContext(
-                        note_path=path,
-                        relevance=relevance,
-                        context=extract_relevant_section(path)
-                    )
+        for row in np.flatnonzero(scores >= similarity_threshold):
+            path = paths[embedded[row]]
+            linked_contexts.append(
+                LinkedContext(
+                    note_path=path,
+                    relevance=float(scores[row]),
+                    context=extract_relevant_section(path)
                 )
+            )
     except Exception as e:
         logger.error(f"Error processing linked notes: {e}")
     
@@ -1,18 +1,21 @@
-from typing import List, Optional, Dict, Any, Set
+from typing import List, Optional, Dict, Any
 from datetime import date, timedelta
+from functools import lru_cache
 from uuid import UUID
-from supabase import Client, create_client
-import json
+from supabase import Client
+import asyncio
+import heapq
 import logging
-from .embedding_helper import generate_embedding
 from .search_helper import (
-    cosine_similarity,
     extract_keywords,
     calculate_keyword_score,
-    get_linked_contexts
+    compile_keyword_pattern,
+    get_linked_contexts,
+    get_query_embedding
 )
 from ..models.search import SearchResult, SearchQuery
 from ..core.config import get_settings
+from ..core.clients import get_supabase, run_supabase
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -23,13 +26,21 @@ DATE_BOOST_NEAR_RANGE = 0.08  # Boost for documents within 7 days of range
 DATE_BOOST_DECAY_DAYS = 30  # Days over which date boost decays to zero
 DATE_MATCH_SCORE = 0.95  # Score for date-matched results (high but allows semantic to rank higher)
 
+# Maximum number of chunks returned by the match_embeddings RPC
+MATCH_COUNT = 250
+
+@lru_cache(maxsize=4096)
+def _parse_date_string(value: str) -> Optional[date]:
+    """Parse an ISO date string; many results share the same few dates."""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
 class SearchService:
     def __init__(self, supabase_client: Optional[Client] = None):
         """Initialize the search service."""
-        self.supabase = supabase_client or create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_KEY
-        )
+        self.supabase = supabase_client or get_supabase()
 
     def _calculate_date_boost(
         self,
@@ -79,10 +90,7 @@ class SearchService:
         if isinstance(date_value, date):
             return date_value
         if isinstance(date_value, str):
-            try:
-                return date.fromisoformat(date_value)
-            except ValueError:
-                return None
+            return _parse_date_string(date_value)
         return None
 
     async def get_date_matched_files(
@@ -111,14 +119,15 @@ class SearchService:
         try:
             logger.info(f"Fetching date-matched files from {date_start} to {date_end}")
 
-            response = self.supabase.table('files')\
+            query = self.supabase.table('files')\
                 .select('id, title, document_date, embeddings(text)')\
                 .eq('user_id', str(user_id))\
                 .gte('document_date', date_start.isoformat())\
                 .lte('document_date', date_end.isoformat())\
                 .order('document_date', desc=True)\
-                .limit(limit)\
-                .execute()
+                .limit(limit)
+            # The Supabase client blocks; keep the event loop free for concurrent work
+            response = await run_supabase(query.execute)
 
             if hasattr(response, 'error') and response.error:
                 logger.error(f"Error fetching date-matched files: {response.error}")
@@ -173,117 +182,99 @@ class SearchService:
         # For temporal queries, first fetch date-matched documents
         # These are ADDED to semantic results, not replacing them
         date_matched_results: List[SearchResult] = []
-        date_matched_ids: Set[str] = set()
 
         if search_query.date_start and search_query.date_end:
-            date_matched_results = await self.get_date_matched_files(
-                search_query.user_id,
-                search_query.date_start,
-                search_query.date_end
+            # Fetch them while the query is being embedded; neither depends on the other
+            date_matched_results, query_vector = await asyncio.gather(
+                self.get_date_matched_files(
+                    search_query.user_id,
+                    search_query.date_start,
+                    search_query.date_end
+                ),
+                get_query_embedding(search_query.query, api_key)
             )
-            date_matched_ids = {str(r.id) for r in date_matched_results}
             logger.info(f"Pre-fetched {len(date_matched_results)} date-matched documents")
-
-        # Generate query embedding
-        query_embedding = generate_embedding(search_query.query, api_key)
+        else:
+            # Generate (or reuse) the normalized query embedding
+            query_vector = await get_query_embedding(search_query.query, api_key)
 
         # Initialize constants
         similarity_threshold = 0.75  # Match src implementation
         highly_relevant_threshold = 0.8  # Match src implementation
-        page_size = 500  # Reduced batch size for memory efficiency
 
         try:
-            # Process embeddings in batches and maintain only the top results
+            # Postgres ranks the chunks with the HNSW index and returns only the
+            # best matches above the threshold, already ordered by similarity
+            response = await run_supabase(self.supabase.rpc('match_embeddings', {
+                'query_embedding': query_vector.tolist(),
+                'match_threshold': similarity_threshold,
+                'match_count': MATCH_COUNT,
+                'uid': str(search_query.user_id),
+                'date_start': search_query.date_start.isoformat() if search_query.date_start else None,
+                'date_end': search_query.date_end.isoformat() if search_query.date_end else None
+            }).execute)
+
+            if hasattr(response, 'error') and response.error:
+                logger.error(f"Error matching embeddings: {response.error}")
+                return []
+
+            logger.info(f"Matched {len(response.data)} chunks")
+
+            # Group chunks by document; rows arrive best first, so the first row
+            # sets the document score and the first five are its top chunks
             grouped_results: Dict[str, Dict[str, Any]] = {}
-            offset = 0
-            
-            while True:
-                logger.info(f"Fetching batch at offset {offset}")
-                query = self.supabase.table('embeddings')\
-                    .select('*, files!inner(title, document_date)')\
-                    .eq('user_id', str(search_query.user_id))
-
-                # Apply date filtering if specified
-                if search_query.date_start:
-                    query = query.gte('files.document_date', search_query.date_start.isoformat())
-                if search_query.date_end:
-                    query = query.lte('files.document_date', search_query.date_end.isoformat())
-
-                response = query.limit(page_size)\
-                    .offset(offset)\
-                    .execute()
-                
-                if hasattr(response, 'error') and response.error:
-                    logger.error(f"Error fetching embeddings: {response.error}")
-                    return []
-                
-                if not response.data:
-                    break
-                
-                batch_size = len(response.data)
-                logger.info(f"Processing batch of {batch_size} embeddings")
-                
-                # Process each embedding in the batch
-                for item in response.data:
-                    embedding = json.loads(item['embedding']) if isinstance(item['embedding'], str) else item['embedding']
-                    score = cosine_similarity(query_embedding, embedding)
-
-                    if score >= similarity_threshold:
-                        doc_id = item['file_id']
-                        # Parse document date
-                        doc_date = self._parse_document_date(item['files'].get('document_date'))
-
-                        if doc_id not in grouped_results:
-                            grouped_results[doc_id] = {
-                                'id': doc_id,
-                                'score': score,
-                                'chunks': [],
-                                'title': item['files']['title'],
-                                'document_date': doc_date
-                            }
-                        # Only keep the top 5 chunks per document
-                        if len(grouped_results[doc_id]['chunks']) < 5:
-                            grouped_results[doc_id]['chunks'].append({
-                                'text': item['text'],
-                                'score': score
-                            })
-                        else:
-                            # Replace lower scoring chunk if this one is better
-                            min_chunk = min(grouped_results[doc_id]['chunks'], key=lambda x: x['score'])
-                            if score > min_chunk['score']:
-                                grouped_results[doc_id]['chunks'].remove(min_chunk)
-                                grouped_results[doc_id]['chunks'].append({
-                                    'text': item['text'],
-                                    'score': score
-                                })
-                
-                if batch_size < page_size:
-                    break
-                    
-                offset += page_size
-            
+            for item in response.data:
+                score = float(item['similarity'])
+                doc_id = item['file_id']
+
+                if doc_id not in grouped_results:
+                    grouped_results[doc_id] = {
+                        'id': doc_id,
+                        'score': score,
+                        'chunks': [],
+                        'title': item['title'],
+                        'document_date': self._parse_document_date(item.get('document_date'))
+                    }
+                # Only keep the top 5 chunks per document
+                if len(grouped_results[doc_id]['chunks']) < 5:
+                    grouped_results[doc_id]['chunks'].append({
+                        'text': item['text'],
+                        'score': score
+                    })
+
             logger.info(f"Found {len(grouped_results)} relevant documents")
             
             # Extract keywords once for all documents
             keywords = extract_keywords(search_query.query)
+            keyword_pattern = compile_keyword_pattern(keywords)
             results: List[SearchResult] = []
             
+            # Combine text from chunks; they were collected best first
+            combined_texts = {
+                doc_id: '\n'.join(chunk['text'] for chunk in data['chunks'])
+                for doc_id, data in grouped_results.items()
+            }
+
+            # Get linked contexts only for highly relevant results, all at once
+            highly_relevant = [
+                doc_id for doc_id, data in grouped_results.items()
+                if data['score'] >= highly_relevant_threshold
+            ]
+            linked_contexts_by_doc = dict(zip(highly_relevant, await asyncio.gather(*(
+                get_linked_contexts(combined_texts[doc_id], query_vector, api_key)
+                for doc_id in highly_relevant
+            ))))
+            
             # Process each document's results
             for doc_id, data in grouped_results.items():
-                # Sort chunks by score
-                sorted_chunks = sorted(data['chunks'], key=lambda x: x['score'], reverse=True)
+                combined_text = combined_texts[doc_id]
 
-                # Combine text from chunks
-                combined_text = '\n'.join(chunk['text'] for chunk in sorted_chunks)
+                # Calculate keyword score; keywords are already lowercase
+                combined_lower = combined_text.lower()
+                keyword_score = calculate_keyword_score(combined_text, keywords, keyword_pattern, combined_lower)
+                matched_keywords = [k for k in keywords if k in combined_lower]
 
-                # Calculate keyword score
-                keyword_score = calculate_keyword_score(combined_text, keywords)
-                matched_keywords = [k for k in keywords if k.lower() in combined_text.lower()]
-
-                # Get linked contexts only for highly relevant results
-                linked_contexts = []
-                if data['score'] >= highly_relevant_threshold:
-                    linked_contexts = await get_linked_contexts(combined_text, query_embedding, api_key)
+                linked_contexts = linked_contexts_by_doc.get(doc_id, [])
 
                 # Calculate date boost if temporal query
                 date_boost = self._calculate_date_boost(
@@ -321,23 +312,24 @@ class SearchService:
             if added_date_matches > 0:
                 logger.info(f"Added {added_date_matches} date-matched documents not found by semantic search")
 
-            # Sort and return top results
-            sorted_results = sorted(results, key=lambda x: x.score, reverse=True)
-            return sorted_results[:50]
+            # Return the top results, best first (same order as a stable sort)
+            return heapq.nlargest(50, results, key=lambda x: x.score)
             
         except Exception as e:
-            logger.error(f"Error fetching embeddings from Supabase: {e}")
+            logger.error(f"Error matching embeddings in Supabase: {e}")
             return []
 
     async def search_by_title(self, title: str, user_id: str) -> Optional[SearchResult]:
         """Search for a file by its exact title."""
         try:
             # Query the files table for an exact title match
-            response = self.supabase.table('files')\
-                .select('*, embeddings(text)')\
-                .eq('title', title)\
-                .eq('user_id', user_id)\
-                .execute()
+            response = await run_supabase(
+                self.supabase.table('files')
+                .select('*, embeddings(text)')
+                .eq('title', title)
+                .eq('user_id', user_id)
+                .execute
+            )
             
             if not response.data:
                 return None
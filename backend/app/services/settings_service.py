@@ -15,13 +15,15 @@ class SettingsService:
     async def get_user_settings(self, user_id: UUID) -> Dict[str, Any]:
         """Get user settings, creating default if none exist."""
         try:
+            # maybe_single() returns None when the user has no row yet; single()
+            # raises instead, which skipped creating the defaults below
             response = self.supabase.table('user_settings')\
                 .select('*')\
                 .eq('user_id', str(user_id))\
-                .single()\
+                .maybe_single()\
                 .execute()
             
-            if not response.data:
+            if response is None or not response.data:
                 # Create default settings
                 default_settings = {
                     'user_id': str(user_id),
@@ -1,18 +1,114 @@
-from typing import List, Optional, Dict, Any
-import aiofiles
+from typing import List, Optional, Dict, Any, Set
+from functools import lru_cache
+import asyncio
+import hashlib
 import json
 import os
 from pathlib import Path
 from uuid import UUID
-from supabase import Client, create_client
+from supabase import Client
 import logging
 
 from ..core.config import get_settings
+from ..core.clients import get_supabase, run_supabase
+from ..core.utils import TTLCache
 from ..models.file import EmbeddingDB
 
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib JSON serializer
+    orjson = None
+
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+# Embedding rows by id; rows are never updated in place, only deleted
+_embedding_cache = TTLCache(maxsize=10_000, ttl=30)
+# Bumped on every delete. Lookups await Supabase, so get_embedding only
+# caches a row if no delete happened while it was being fetched
+_embedding_generation = 0
+
+def invalidate_file_embeddings(file_id: UUID) -> None:
+    """Drop cached embedding rows of a file whose embeddings were deleted."""
+    global _embedding_generation
+    _embedding_generation += 1
+    file_id = str(file_id)
+    _embedding_cache.pop_where(lambda row: str(row.get('file_id')) == file_id)
+
+# Seconds EmbeddingLoader waits for more ids before querying
+EMBEDDING_LOAD_WINDOW = 0.005
+
+class EmbeddingLoader:
+    """
+    Coalesces concurrent embedding lookups into one Supabase query.
+
+    Ids requested within EMBEDDING_LOAD_WINDOW of each other are fetched with
+    a single in_ filter instead of a round trip each.
+    """
+    
+    def __init__(self, supabase: Client):
+        self.supabase = supabase
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    async def load(self, embedding_id: str) -> Optional[Dict[str, Any]]:
+        """Return the embedding row with this id, or None if there is none."""
+        future = self._pending.get(embedding_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[embedding_id] = future
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush())
+        # Several callers may wait on one future; one cancelling mustn't cancel the rest
+        return await asyncio.shield(future)
+    
+    def _fetch(self, embedding_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch embedding rows by id (blocking)."""
+        response = self.supabase.table('embeddings')\
+            .select('*')\
+            .in_('id', embedding_ids)\
+            .execute()
+        return {str(row['id']): row for row in response.data}
+    
+    async def _flush(self) -> None:
+        """Fetch every id requested during the window and resolve its future."""
+        await asyncio.sleep(EMBEDDING_LOAD_WINDOW)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        
+        try:
+            rows = await run_supabase(self._fetch, list(pending))
+        except Exception as e:
+            if len(pending) == 1:
+                for future in pending.values():
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            # One malformed id fails the whole query; look the ids up
+            # separately so it can't take the others down with it
+            logger.warning(f"Batched embedding lookup failed, retrying ids separately: {e}")
+            results = await asyncio.gather(
+                *(run_supabase(self._fetch, [embedding_id]) for embedding_id in pending),
+                return_exceptions=True
+            )
+            for (embedding_id, future), result in zip(pending.items(), results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result.get(embedding_id))
+            return
+        
+        for embedding_id, future in pending.items():
+            if not future.done():
+                future.set_result(rows.get(embedding_id))
+
+@lru_cache()
+def _get_embedding_loader(supabase: Client) -> EmbeddingLoader:
+    """Return the loader shared by every StorageService using this client."""
+    return EmbeddingLoader(supabase)
+
 class StorageService:
     """
     Storage service for managing embeddings with local backup functionality.
@@ -24,68 +120,96 @@ class StorageService:
         supabase_client: Optional[Client] = None,
         storage_dir: Optional[str] = None
     ):
-        self.supabase = supabase_client or create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_KEY
-        )
+        self.supabase = supabase_client or get_supabase()
         self.storage_dir = Path(storage_dir or "embeddings_backup")
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Shard directories already created by this instance
+        self._shard_dirs: Set[Path] = set()
+    
+    def _safe_id(self, embedding_id: str) -> str:
+        """Make an embedding ID safe to use as a file name."""
+        return str(embedding_id).replace('/', '_').replace('\\', '_')
     
     def _get_file_path(self, embedding_id: str) -> Path:
-        """Get the file path for an embedding ID."""
-        safe_id = str(embedding_id).replace('/', '_').replace('\\', '_')
-        return self.storage_dir / f"{safe_id}.json"
+        """
+        Get the file path for an embedding ID.
+        
+        Backups are spread over storage_dir/ab/cd/ by a hash of the ID so no
+        single directory grows to hold every embedding.
+        """
+        safe_id = self._safe_id(embedding_id)
+        shard = hashlib.blake2b(safe_id.encode('utf-8'), digest_size=2).hexdigest()
+        return self.storage_dir / shard[:2] / shard[2:] / f"{safe_id}.json"
+    
+    def _get_legacy_file_path(self, embedding_id: str) -> Path:
+        """Get the flat file path backups were written to before sharding."""
+        return self.storage_dir / f"{self._safe_id(embedding_id)}.json"
     
     async def save_embedding_backup(self, embedding: Dict[str, Any]) -> None:
         """Save embedding to local backup storage."""
         file_path = self._get_file_path(embedding['id'])
-        async with aiofiles.open(file_path, 'w') as f:
-            await f.write(json.dumps(embedding))
+        # orjson writes bytes directly and serializes numpy vectors without
+        # converting them to lists first
+        if orjson is not None:
+            content = orjson.dumps(embedding, option=orjson.OPT_SERIALIZE_NUMPY)
+        else:
+            content = json.dumps(embedding).encode('utf-8')
+        if file_path.parent not in self._shard_dirs:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            self._shard_dirs.add(file_path.parent)
+        # One thread hop for open, write and close together
+        await asyncio.to_thread(file_path.write_bytes, content)
     
     async def get_embedding_backup(self, embedding_id: str) -> Optional[Dict[str, Any]]:
         """Get embedding from local backup storage."""
-        file_path = self._get_file_path(embedding_id)
         try:
-            async with aiofiles.open(file_path, 'r') as f:
-                content = await f.read()
-                return json.loads(content)
+            content = await asyncio.to_thread(self._get_file_path(embedding_id).read_bytes)
         except FileNotFoundError:
-            return None
+            # Backups written before sharding are still in the top-level directory
+            try:
+                content = await asyncio.to_thread(self._get_legacy_file_path(embedding_id).read_bytes)
+            except FileNotFoundError:
+                return None
+        return orjson.loads(content) if orjson is not None else json.loads(content)
     
     async def save_embedding(self, embedding: Dict[str, Any]) -> Optional[EmbeddingDB]:
         """Save embedding to Supabase and local backup."""
+        # The backup is written whatever the outcome, so write it while the
+        # (blocking) insert runs in a worker thread
+        backup = asyncio.create_task(self.save_embedding_backup(embedding))
         try:
             # Save to Supabase
-            response = self.supabase.table('embeddings').insert(embedding).execute()
+            response = await run_supabase(
+                self.supabase.table('embeddings').insert(embedding).execute
+            )
             if hasattr(response, 'error') and response.error:
                 logger.error(f"Error saving to Supabase: {response.error}")
-                # Save to backup and return None
-                await self.save_embedding_backup(embedding)
                 return None
             
-            # Save to backup storage
-            await self.save_embedding_backup(embedding)
-            
             return EmbeddingDB(**response.data[0])
             
         except Exception as e:
             logger.error(f"Error saving embedding: {e}")
-            # Save to backup
-            await self.save_embedding_backup(embedding)
             return None
+        finally:
+            await backup
     
     async def get_embedding(self, embedding_id: str) -> Optional[Dict[str, Any]]:
         """Get embedding from Supabase or fall back to local storage."""
+        cached = _embedding_cache.get(embedding_id)
+        if cached is not None:
+            # Copy so callers can't modify the shared row
+            return dict(cached)
+        
+        generation = _embedding_generation
         try:
-            # Try Supabase first
-            response = self.supabase.table('embeddings')\
-                .select('*')\
-                .eq('id', embedding_id)\
-                .single()\
-                .execute()
+            # Try Supabase first, batched with any concurrent lookups
+            data = await _get_embedding_loader(self.supabase).load(str(embedding_id))
             
-            if response.data:
-                return response.data
+            if data:
+                if _embedding_generation == generation:
+                    _embedding_cache.set(embedding_id, data)
+                return dict(data)
                 
         except Exception as e:
             logger.error(f"Error getting embedding from Supabase: {e}")
@@ -97,10 +221,12 @@ class StorageService:
         """Get all embeddings for a specific user."""
         try:
             # Try Supabase first
-            response = self.supabase.table('embeddings')\
-                .select('*')\
-                .eq('user_id', str(user_id))\
-                .execute()
+            response = await run_supabase(
+                self.supabase.table('embeddings')
+                .select('*')
+                .eq('user_id', str(user_id))
+                .execute
+            )
             
             if hasattr(response, 'error') and response.error:
                 logger.error(f"Error getting embeddings from Supabase: {response.error}")
@@ -114,14 +240,17 @@ class StorageService:
     
     async def delete_embedding(self, embedding_id: str) -> bool:
         """Delete an embedding from both Supabase and local storage."""
+        global _embedding_generation
         success = True
         
         # Delete from Supabase
         try:
-            response = self.supabase.table('embeddings')\
-                .delete()\
-                .eq('id', embedding_id)\
-                .execute()
+            response = await run_supabase(
+                self.supabase.table('embeddings')
+                .delete()
+                .eq('id', embedding_id)
+                .execute
+            )
             
             if hasattr(response, 'error') and response.error:
                 logger.error(f"Error deleting from Supabase: {response.error}")
@@ -131,12 +260,16 @@ class StorageService:
             logger.error(f"Error deleting from Supabase: {e}")
             success = False
         
+        # After the delete, so a lookup racing it can't cache the row again
+        _embedding_generation += 1
+        _embedding_cache.pop(embedding_id)
+        
         # Delete from local storage
         try:
-            file_path = self._get_file_path(embedding_id)
-            if file_path.exists():
-                file_path.unlink()
-        except Exception as e:
+            for file_path in (self._get_file_path(embedding_id), self._get_legacy_file_path(embedding_id)):
+                # No exists() probe: one syscall, and no race with another delete
+                await asyncio.to_thread(file_path.unlink, missing_ok=True)
+        except OSError as e:
             logger.error(f"Error deleting local backup: {e}")
             success = False
         
@@ -1,23 +1,56 @@
-from typing import Optional, List
+from typing import Dict, Optional, List
 from fastapi import UploadFile, HTTPException
 import aiofiles
+import asyncio
 import os
 import re
+import string
+import tempfile
 from datetime import datetime
+from pathlib import Path
 from uuid import UUID, uuid4
-from supabase import Client, create_client
+from supabase import Client
 from .embedding_service import EmbeddingService
 from .date_extraction_service import DateExtractionService
+from .storage_service import invalidate_file_embeddings
 from ..models.file import FileCreate, FileDB, FileUploadResponse
 from ..core.config import get_settings
+from ..core.clients import get_supabase, run_supabase
+from ..core.utils import TTLCache
 import logging
-from io import BytesIO
 from PyPDF2 import PdfReader
 import docx
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+# File lists by user id; every write to a user's files pops their entry
+_user_files_cache = TTLCache(maxsize=1024, ttl=30)
+# Bumped on every write to a user's files. The Supabase fetch yields to the
+# event loop, so get_user_files only caches its result if no write happened
+# while it was in flight
+_user_files_generation: Dict[str, int] = {}
+
+def _invalidate_user_files(user_id: UUID) -> None:
+    """Drop a user's cached file list and fence off fetches already running."""
+    key = str(user_id)
+    _user_files_generation[key] = _user_files_generation.get(key, 0) + 1
+    _user_files_cache.pop(key)
+
+# Lowercased once; extensions are compared case-insensitively
+_ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in settings.ALLOWED_EXTENSIONS)
+
+# Characters _sanitize_filename replaces with '_'
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\-_\. ]')
+# The same replacement for ASCII names, done by str.translate
+_SAFE_FILENAME_CHARS = frozenset(string.ascii_letters + string.digits + '-_. ')
+_UNSAFE_FILENAME_TABLE = str.maketrans({
+    c: '_' for c in map(chr, range(128)) if c not in _SAFE_FILENAME_CHARS
+})
+
+# Bytes read from an upload at a time while spooling it to disk
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 class UploadService:
     def __init__(
         self,
@@ -26,19 +59,14 @@ class UploadService:
         date_extraction_service: Optional[DateExtractionService] = None
     ):
         """Initialize the upload service."""
-        self.supabase = supabase_client or create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_KEY
-        )
+        self.supabase = supabase_client or get_supabase()
         self.embedding_service = embedding_service or EmbeddingService(self.supabase)
         self.date_extraction_service = date_extraction_service or DateExtractionService()
 
-    def _extract_text_from_pdf(self, content: bytes) -> str:
-        """Extract text from PDF content."""
-        pdf_file = None
+    def _extract_text_from_pdf(self, file_path: str) -> str:
+        """Extract text from a PDF file."""
         try:
-            pdf_file = BytesIO(content)
-            pdf_reader = PdfReader(pdf_file)
+            pdf_reader = PdfReader(file_path)
             text = []
             for page in pdf_reader.pages:
                 text.append(page.extract_text())
@@ -49,17 +77,11 @@ class UploadService:
                 status_code=422,
                 detail=f"Error extracting text from PDF: {str(e)}"
             )
-        finally:
-            if pdf_file:
-                pdf_file.close()
-                del pdf_file
 
-    def _extract_text_from_docx(self, content: bytes) -> str:
-        """Extract text from DOCX content."""
-        docx_file = None
+    def _extract_text_from_docx(self, file_path: str) -> str:
+        """Extract text from a DOCX file."""
         try:
-            docx_file = BytesIO(content)
-            doc = docx.Document(docx_file)
+            doc = docx.Document(file_path)
             text = []
             for paragraph in doc.paragraphs:
                 if paragraph.text:
@@ -71,18 +93,14 @@ class UploadService:
                 status_code=422,
                 detail=f"Error extracting text from DOCX: {str(e)}"
             )
-        finally:
-            if docx_file:
-                docx_file.close()
-                del docx_file
 
-    def _extract_text_from_binary(self, content: bytes, filename: str) -> str:
+    def _extract_text_from_binary(self, file_path: str, filename: str) -> str:
         """Extract text from binary file formats."""
         ext = filename.lower().split('.')[-1]
         if ext == 'pdf':
-            return self._extract_text_from_pdf(content)
+            return self._extract_text_from_pdf(file_path)
         elif ext in ['docx', 'doc']:
-            return self._extract_text_from_docx(content)
+            return self._extract_text_from_docx(file_path)
         else:
             raise HTTPException(
                 status_code=422,
@@ -91,7 +109,15 @@ class UploadService:
 
     def _sanitize_filename(self, filename: str) -> str:
         """Sanitize the filename to be safe for storage."""
-        return re.sub(r'[^\w\-_\. ]', '_', filename)
+        if filename.isascii():
+            return filename.translate(_UNSAFE_FILENAME_TABLE)
+        return _UNSAFE_FILENAME_RE.sub('_', filename)
+
+    def _upload_to_storage(self, storage_path: str, file_path: str):
+        """Upload a file from disk to Supabase storage (blocking)."""
+        # storage3 streams BufferedReader objects instead of reading them into memory
+        with open(file_path, 'rb') as f:
+            return self.supabase.storage.from_('documents').upload(storage_path, f)
 
     def _check_file_size(self, file_size: int) -> None:
         """Check if file size is within limits."""
@@ -103,33 +129,25 @@ class UploadService:
 
     def _check_file_extension(self, filename: str) -> None:
         """Check if file extension is allowed."""
-        try:
-            ext = filename.split('.')[-1].lower() if '.' in filename else ''
-            logger.info(f"Checking file extension: {ext} for file: {filename}")
-            
-            if not ext:
-                logger.error(f"No file extension found for file: {filename}")
-                raise HTTPException(
-                    status_code=422,
-                    detail="File must have an extension"
-                )
-                
-            if ext not in settings.ALLOWED_EXTENSIONS:
-                logger.error(f"Invalid file extension: {ext}. Allowed: {settings.ALLOWED_EXTENSIONS}")
-                raise HTTPException(
-                    status_code=415,
-                    detail=f"File extension .{ext} not allowed. Allowed extensions: {', '.join(settings.ALLOWED_EXTENSIONS)}"
-                )
-                
-            logger.info(f"File extension {ext} is allowed")
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Error checking file extension for {filename}: {str(e)}")
+        _, sep, ext = (filename or '').rpartition('.')
+        ext = ext.lower()
+        logger.debug("Checking file extension: %s for file: %s", ext, filename)
+        
+        if not sep or not ext:
+            logger.error(f"No file extension found for file: {filename}")
             raise HTTPException(
                 status_code=422,
-                detail=f"Invalid filename or extension: {str(e)}"
+                detail="File must have an extension"
             )
+            
+        if ext not in _ALLOWED_EXTENSIONS:
+            logger.error(f"Invalid file extension: {ext}. Allowed: {settings.ALLOWED_EXTENSIONS}")
+            raise HTTPException(
+                status_code=415,
+                detail=f"File extension .{ext} not allowed. Allowed extensions: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+            )
+            
+        logger.debug("File extension %s is allowed", ext)
 
     async def _check_duplicate_file(self, filename: str, user_id: UUID) -> Optional[FileDB]:
         """
@@ -138,11 +156,13 @@ class UploadService:
         (status is 'error' or 'pending_embedding').
         """
         try:
-            response = self.supabase.table('files')\
-                .select('*')\
-                .eq('user_id', str(user_id))\
-                .eq('filename', filename)\
-                .execute()
+            response = await run_supabase(
+                self.supabase.table('files')
+                .select('*')
+                .eq('user_id', str(user_id))
+                .eq('filename', filename)
+                .execute
+            )
 
             if hasattr(response, 'error') and response.error:
                 logger.error(f"Error checking for duplicate file: {response.error}")
@@ -156,15 +176,20 @@ class UploadService:
                     # Delete the old file record since we'll create a new one
                     try:
                         # Delete from storage first
-                        self.supabase.storage.from_('documents')\
-                            .remove([existing_file.storage_path])
+                        await run_supabase(
+                            self.supabase.storage.from_('documents').remove,
+                            [existing_file.storage_path]
+                        )
                         logger.info(f"Deleted old file from storage: {existing_file.storage_path}")
                         
                         # Then delete the database record
-                        self.supabase.table('files')\
-                            .delete()\
-                            .eq('id', existing_file.id)\
-                            .execute()
+                        await run_supabase(
+                            self.supabase.table('files')
+                            .delete()
+                            .eq('id', existing_file.id)
+                            .execute
+                        )
+                        invalidate_file_embeddings(existing_file.id)
                         logger.info(f"Deleted old file record from database: {existing_file.id}")
                     except Exception as e:
                         logger.error(f"Error cleaning up old file: {str(e)}")
@@ -182,10 +207,10 @@ class UploadService:
         api_key: Optional[str] = None
     ) -> FileUploadResponse:
         """Save file to storage and generate embeddings."""
-        content = None
+        spool_path = None
         try:
-            logger.info(f"Starting file upload process for: {file.filename}")
-            logger.info(f"User ID: {user_id}")
+            logger.info("Starting file upload process for: %s", file.filename)
+            logger.debug("User ID: %s", user_id)
             
             # Check for duplicate file
             existing_file = await self._check_duplicate_file(file.filename, user_id)
@@ -199,37 +224,31 @@ class UploadService:
                     embedding_status="skipped_duplicate"
                 )
             
-            # Read file content
-            content = await file.read()
-            content_size = len(content)
-            logger.info(f"File size: {content_size} bytes")
-            
-            try:
-                self._check_file_size(content_size)
-                logger.info("File size validation passed")
-            except HTTPException as e:
-                logger.error(f"File size validation failed: {str(e)}")
-                raise
-
-            try:
-                self._check_file_extension(file.filename)
-                logger.info("File extension validation passed")
-            except HTTPException as e:
-                logger.error(f"File extension validation failed: {str(e)}")
-                raise
+            # Spool the upload to a temporary file in chunks rather than holding
+            # it all in memory, rejecting it as soon as it grows past the limit
+            content_size = 0
+            with tempfile.NamedTemporaryFile(delete=False) as spool:
+                spool_path = spool.name
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    content_size += len(chunk)
+                    self._check_file_size(content_size)
+                    spool.write(chunk)
+            logger.debug("File size: %d bytes", content_size)
+
+            self._check_file_extension(file.filename)
 
             # Create unique filename
             file_id = uuid4()
             sanitized_filename = self._sanitize_filename(file.filename)
             storage_path = f"{user_id}/{file_id}/{sanitized_filename}"
-            logger.info(f"Generated storage path: {storage_path}")
+            logger.debug("Generated storage path: %s", storage_path)
 
             # Upload to Supabase storage
-            logger.info("Attempting to upload to Supabase storage")
             try:
-                storage_response = self.supabase.storage.from_('documents').upload(
+                storage_response = await run_supabase(
+                    self._upload_to_storage,
                     storage_path,
-                    content
+                    spool_path
                 )
 
                 if hasattr(storage_response, 'error') and storage_response.error:
@@ -238,7 +257,7 @@ class UploadService:
                         status_code=500,
                         detail=f"Error uploading file: {storage_response.error['message']}"
                     )
-                logger.info("Successfully uploaded to Supabase storage")
+                logger.debug("Uploaded %s to Supabase storage", storage_path)
             except Exception as e:
                 logger.error(f"Failed to upload to Supabase storage: {str(e)}")
                 raise HTTPException(
@@ -253,10 +272,12 @@ class UploadService:
             if extracted_date:
                 document_date = extracted_date.date
                 date_source = extracted_date.source
-                logger.info(f"Extracted date {document_date} from filename (source: {date_source}, confidence: {extracted_date.confidence})")
+                logger.debug(
+                    "Extracted date %s from filename (source: %s, confidence: %s)",
+                    document_date, date_source, extracted_date.confidence
+                )
 
             # Save file metadata
-            logger.info("Saving file metadata")
             file_data = FileCreate(
                 filename=file.filename,
                 storage_path=storage_path,
@@ -268,11 +289,12 @@ class UploadService:
             )
 
             try:
-                # Convert model to dict and ensure UUIDs are converted to strings
-                metadata = file_data.model_dump()
-                metadata['user_id'] = str(metadata['user_id'])  # Convert UUID to string
+                # JSON-ready dict; UUIDs and dates are already strings
+                metadata = file_data.model_dump(mode='json')
                 
-                file_response = self.supabase.table('files').insert(metadata).execute()
+                file_response = await run_supabase(
+                    self.supabase.table('files').insert(metadata).execute
+                )
 
                 if hasattr(file_response, 'error') and file_response.error:
                     logger.error(f"Database error saving metadata: {file_response.error}")
@@ -280,7 +302,7 @@ class UploadService:
                         status_code=500,
                         detail=f"Error saving file metadata: {file_response.error['message']}"
                     )
-                logger.info("Successfully saved file metadata")
+                logger.debug("Saved file metadata")
             except Exception as e:
                 logger.error(f"Failed to save file metadata: {str(e)}")
                 raise HTTPException(
@@ -293,13 +315,15 @@ class UploadService:
 
             # Generate embeddings asynchronously only if file is not empty
             if content_size > 0:
-                logger.info("Starting embedding generation")
                 try:
                     # Handle binary files (PDF, DOCX)
                     ext = file.filename.lower().split('.')[-1]
                     if ext in ['pdf', 'docx', 'doc']:
-                        text_content = self._extract_text_from_binary(content, file.filename)
+                        text_content = await asyncio.to_thread(
+                            self._extract_text_from_binary, spool_path, file.filename
+                        )
                     else:
+                        content = await asyncio.to_thread(Path(spool_path).read_bytes)
                         try:
                             text_content = content.decode('utf-8')
                         except UnicodeDecodeError:
@@ -308,9 +332,9 @@ class UploadService:
                                 status_code=422,
                                 detail="File content must be valid UTF-8 text"
                             )
-
-                    # Clear content from memory after text extraction
-                    del content
+                        finally:
+                            # Clear content from memory after text extraction
+                            del content
                     
                     try:
                         await self.embedding_service.generate_and_save_embedding(
@@ -322,15 +346,17 @@ class UploadService:
                         # Clear text content from memory after embedding generation
                         del text_content
                         
-                        logger.info("Successfully generated embeddings")
+                        logger.debug("Generated embeddings")
                         embedding_status = "completed"
                         
                         # Update file status to indexed
                         try:
-                            self.supabase.table('files').update({
-                                'status': 'indexed'
-                            }).eq('id', file_record.id).execute()
-                            logger.info("Successfully updated file status to indexed")
+                            await run_supabase(
+                                self.supabase.table('files').update({
+                                    'status': 'indexed'
+                                }).eq('id', file_record.id).execute
+                            )
+                            logger.debug("Updated file status to indexed")
                         except Exception as e:
                             logger.error(f"Failed to update file status: {str(e)}")
                     except ValueError as ve:
@@ -338,9 +364,11 @@ class UploadService:
                             logger.warning(f"Date format error during embedding generation: {str(ve)}")
                             embedding_status = "error_date_format"
                             # Continue processing despite date format error
-                            self.supabase.table('files').update({
-                                'status': 'indexed'
-                            }).eq('id', file_record.id).execute()
+                            await run_supabase(
+                                self.supabase.table('files').update({
+                                    'status': 'indexed'
+                                }).eq('id', file_record.id).execute
+                            )
                         else:
                             embedding_status = "error"
                             logger.error(f"Embedding generation failed: {str(ve)}")
@@ -348,19 +376,21 @@ class UploadService:
                         embedding_status = "error"
                         logger.error(f"Failed to generate embeddings: {str(e)}")
                         # Update file status to error but don't fail the upload
-                        self.supabase.table('files').update({
-                            'status': 'error'
-                        }).eq('id', file_record.id).execute()
+                        await run_supabase(
+                            self.supabase.table('files').update({
+                                'status': 'error'
+                            }).eq('id', file_record.id).execute
+                        )
                 except Exception as e:
                     embedding_status = "error"
                     logger.error(f"Failed to process file content: {str(e)}")
-                    self.supabase.table('files').update({
-                        'status': 'error'
-                    }).eq('id', file_record.id).execute()
+                    await run_supabase(
+                        self.supabase.table('files').update({
+                            'status': 'error'
+                        }).eq('id', file_record.id).execute
+                    )
                 finally:
                     # Ensure content is cleared even if there are errors
-                    if 'content' in locals():
-                        del content
                     if 'text_content' in locals():
                         del text_content
 
@@ -381,17 +411,30 @@ class UploadService:
                 detail=f"An unexpected error occurred while processing the file: {str(e)}"
             )
         finally:
+            # The upload may have added, removed or updated file records
+            _invalidate_user_files(user_id)
             # Final cleanup
-            if 'content' in locals():
-                del content
+            if spool_path is not None:
+                try:
+                    os.unlink(spool_path)
+                except OSError as e:
+                    logger.warning(f"Failed to remove temporary upload {spool_path}: {str(e)}")
 
     async def get_user_files(self, user_id: UUID) -> List[FileDB]:
         """Fetch the list of files for a user."""
+        key = str(user_id)
+        cached = _user_files_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        generation = _user_files_generation.get(key, 0)
         try:
-            response = self.supabase.table('files')\
-                .select('*')\
-                .eq('user_id', str(user_id))\
-                .execute()
+            response = await run_supabase(
+                self.supabase.table('files')
+                .select('*')
+                .eq('user_id', str(user_id))
+                .execute
+            )
 
             if hasattr(response, 'error') and response.error:
                 raise HTTPException(
@@ -399,7 +442,11 @@ class UploadService:
                     detail=f"Error fetching files: {response.error['message']}"
                 )
 
-            return [FileDB(**item) for item in response.data]
+            files = [FileDB(**item) for item in response.data]
+            # A write that landed mid-fetch may not be reflected in this list
+            if _user_files_generation.get(key, 0) == generation:
+                _user_files_cache.set(key, files)
+            return list(files)
         except Exception as e:
             logger.error(f"Error fetching files for user {user_id}: {e}")
             raise HTTPException(
@@ -420,12 +467,14 @@ class UploadService:
         """
         try:
             # First verify the file belongs to the user
-            file_response = self.supabase.table('files')\
-                .select('*')\
-                .eq('id', str(file_id))\
-                .eq('user_id', str(user_id))\
-                .single()\
-                .execute()
+            file_response = await run_supabase(
+                self.supabase.table('files')
+                .select('*')
+                .eq('id', str(file_id))
+                .eq('user_id', str(user_id))
+                .single()
+                .execute
+            )
 
             if not file_response.data:
                 raise HTTPException(status_code=404, detail="File not found")
@@ -435,28 +484,36 @@ class UploadService:
 
             # 1. Delete embeddings for this file
             try:
-                embed_response = self.supabase.table('embeddings')\
-                    .delete()\
-                    .eq('file_id', str(file_id))\
-                    .execute()
+                embed_response = await run_supabase(
+                    self.supabase.table('embeddings')
+                    .delete()
+                    .eq('file_id', str(file_id))
+                    .execute
+                )
                 logger.info(f"Deleted embeddings for file {file_id}")
             except Exception as e:
                 logger.warning(f"Error deleting embeddings (may not exist): {str(e)}")
+            finally:
+                invalidate_file_embeddings(file_id)
 
             # 2. Delete from storage
             try:
-                self.supabase.storage.from_('documents')\
-                    .remove([file_record.storage_path])
+                await run_supabase(
+                    self.supabase.storage.from_('documents').remove,
+                    [file_record.storage_path]
+                )
                 logger.info(f"Deleted file from storage: {file_record.storage_path}")
             except Exception as e:
                 logger.warning(f"Error deleting from storage (may not exist): {str(e)}")
 
             # 3. Delete file record from database
             try:
-                self.supabase.table('files')\
-                    .delete()\
-                    .eq('id', str(file_id))\
-                    .execute()
+                await run_supabase(
+                    self.supabase.table('files')
+                    .delete()
+                    .eq('id', str(file_id))
+                    .execute
+                )
                 logger.info(f"Deleted file record from database: {file_id}")
             except Exception as e:
                 logger.error(f"Error deleting file record: {str(e)}")
@@ -475,6 +532,8 @@ class UploadService:
                 status_code=500,
                 detail=f"Error deleting file: {str(e)}"
             )
+        finally:
+            _invalidate_user_files(user_id)
 
     async def delete_file_by_name(self, filename: str, user_id: UUID) -> bool:
         """
@@ -484,11 +543,13 @@ class UploadService:
         """
         try:
             # Find the file by name
-            response = self.supabase.table('files')\
-                .select('*')\
-                .eq('user_id', str(user_id))\
-                .eq('filename', filename)\
-                .execute()
+            response = await run_supabase(
+                self.supabase.table('files')
+                .select('*')
+                .eq('user_id', str(user_id))
+                .eq('filename', filename)
+                .execute
+            )
 
             if not response.data:
                 logger.info(f"No file found with name {filename} for user {user_id}")
@@ -549,12 +610,14 @@ class UploadService:
         """Get the content of a file."""
         try:
             # First verify the file belongs to the user
-            file_response = self.supabase.table('files')\
-                .select('*')\
-                .eq('id', str(file_id))\
-                .eq('user_id', str(user_id))\
-                .single()\
-                .execute()
+            file_response = await run_supabase(
+                self.supabase.table('files')
+                .select('*')
+                .eq('id', str(file_id))
+                .eq('user_id', str(user_id))
+                .single()
+                .execute
+            )
 
             if not file_response.data:
                 raise HTTPException(status_code=404, detail="File not found")
@@ -562,8 +625,10 @@ class UploadService:
             file_record = FileDB(**file_response.data)
 
             # Download the file content
-            content = self.supabase.storage.from_('documents')\
-                .download(file_record.storage_path)
+            content = await run_supabase(
+                self.supabase.storage.from_('documents').download,
+                file_record.storage_path
+            )
 
             return content.decode('utf-8')
         except HTTPException:
@@ -0,0 +1,9 @@
+-- Content-addressed cache of chunk embeddings, used by EmbeddingService to
+-- skip re-embedding unchanged text when a file is re-indexed.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    hash TEXT NOT NULL,          -- sha256 hex digest of the chunk text
+    model TEXT NOT NULL,         -- embedding model that produced the vector
+    embedding JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (hash, model)
+);
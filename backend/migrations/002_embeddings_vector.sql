@@ -0,0 +1,7 @@
+-- Store embeddings as pgvector instead of JSON text: 4 bytes per dimension
+-- on disk instead of ~20, and the column can back native similarity indexes.
+CREATE EXTENSION IF NOT EXISTS vector;
+
+ALTER TABLE embeddings
+    ALTER COLUMN embedding TYPE vector(1536)
+    USING embedding::text::vector;
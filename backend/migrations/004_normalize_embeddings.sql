@@ -0,0 +1,5 @@
+-- New embeddings are stored at unit length so search can score them with a
+-- plain dot product. OpenAI embeddings are already close to unit length;
+-- this removes the remaining drift in rows written before that change.
+UPDATE embeddings
+    SET embedding = l2_normalize(embedding);
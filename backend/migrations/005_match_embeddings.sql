@@ -0,0 +1,39 @@
+-- Push similarity search into Postgres: an HNSW index over the unit-length
+-- halfvec embeddings and an RPC returning the top matching chunks already
+-- ranked, so SearchService no longer pages every row through Python.
+-- Inner product (<#>) equals cosine similarity for unit-length vectors.
+CREATE INDEX IF NOT EXISTS embeddings_embedding_hnsw_idx
+    ON embeddings USING hnsw (embedding halfvec_ip_ops);
+
+CREATE OR REPLACE FUNCTION match_embeddings(
+    query_embedding halfvec(1536),
+    match_threshold float,
+    match_count int,
+    uid uuid,
+    date_start date DEFAULT NULL,
+    date_end date DEFAULT NULL
+)
+RETURNS TABLE (
+    file_id uuid,
+    text text,
+    similarity float,
+    title text,
+    document_date date
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        e.file_id,
+        e.text,
+        -(e.embedding <#> query_embedding) AS similarity,
+        f.title,
+        f.document_date
+    FROM embeddings e
+    JOIN files f ON f.id = e.file_id
+    WHERE e.user_id = uid
+        AND (date_start IS NULL OR f.document_date >= date_start)
+        AND (date_end IS NULL OR f.document_date <= date_end)
+        AND -(e.embedding <#> query_embedding) >= match_threshold
+    ORDER BY e.embedding <#> query_embedding
+    LIMIT match_count;
+$$;
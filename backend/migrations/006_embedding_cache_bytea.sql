@@ -0,0 +1,9 @@
+-- Store cached embeddings as packed little-endian float32 (see
+-- embedding_helper.pack_embedding) instead of JSONB: 6 KB per vector, and
+-- less than half the text to transfer and parse on every cache lookup.
+-- Existing JSONB entries are dropped; they are regenerated on the next miss.
+TRUNCATE embedding_cache;
+
+ALTER TABLE embedding_cache
+    ALTER COLUMN embedding TYPE BYTEA
+    USING NULL;
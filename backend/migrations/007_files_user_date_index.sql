@@ -0,0 +1,6 @@
+-- Serves SearchService.get_date_matched_files: filter by user and document
+-- date range, newest first, limited. With this index Postgres reads matching
+-- rows already in order and stops after the limit instead of sorting.
+CREATE INDEX IF NOT EXISTS files_user_document_date_idx
+    ON files (user_id, document_date DESC)
+    WHERE document_date IS NOT NULL;
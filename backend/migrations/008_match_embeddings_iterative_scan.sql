@@ -0,0 +1,47 @@
+-- An HNSW scan only returns about hnsw.ef_search (default 40) candidates from
+-- the whole table, and match_embeddings' user, date and threshold filters were
+-- applied after that, so most users' searches came back short or empty.
+-- Iterative index scans keep walking the graph until enough rows pass the
+-- filters; they need pgvector 0.8.0+.
+--
+-- The inner query stops after match_count rows of this user's (date-filtered)
+-- chunks; the similarity threshold is applied outside it so rows below the
+-- threshold don't keep the scan running to hnsw.max_scan_tuples.
+CREATE OR REPLACE FUNCTION match_embeddings(
+    query_embedding halfvec(1536),
+    match_threshold float,
+    match_count int,
+    uid uuid,
+    date_start date DEFAULT NULL,
+    date_end date DEFAULT NULL
+)
+RETURNS TABLE (
+    file_id uuid,
+    text text,
+    similarity float,
+    title text,
+    document_date date
+)
+LANGUAGE sql STABLE
+SET hnsw.iterative_scan = strict_order
+SET hnsw.ef_search = 400
+AS $$
+    SELECT matches.file_id, matches.text, matches.similarity, matches.title, matches.document_date
+    FROM (
+        SELECT
+            e.file_id,
+            e.text,
+            -(e.embedding <#> query_embedding) AS similarity,
+            f.title,
+            f.document_date
+        FROM embeddings e
+        JOIN files f ON f.id = e.file_id
+        WHERE e.user_id = uid
+            AND (date_start IS NULL OR f.document_date >= date_start)
+            AND (date_end IS NULL OR f.document_date <= date_end)
+        ORDER BY e.embedding <#> query_embedding
+        LIMIT match_count
+    ) matches
+    WHERE matches.similarity >= match_threshold
+    ORDER BY matches.similarity DESC;
+$$;
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Settings are read at import time; give the required ones dummy values
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+from app.services import embedding_service
+from app.services.embedding_service import EmbeddingService
+
+WORDS = ["alpha", "beta", "gamma", "delta", "note", "idea", "x", "longerword"]
+
+
+def baseline_spans(text, chunk_size, overlap):
+    """The original character chunker, as (start, end) spans of the stripped chunks.
+
+    It re-emits ever shorter tails of a chunk while crawling forward one
+    character at a time; those chunks lie inside the previous one and are
+    dropped here.
+    """
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            for separator in ["\n\n", "\n", ". ", " "]:
+                pos = text[start:end].rfind(separator)
+                if pos != -1:
+                    end = start + pos + len(separator)
+                    break
+        chunk_start, chunk_end = start, end
+        while chunk_start < chunk_end and text[chunk_start].isspace():
+            chunk_start += 1
+        while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+            chunk_end -= 1
+        if chunk_end > chunk_start and not (
+            spans and spans[-1][0] <= chunk_start and chunk_end <= spans[-1][1]
+        ):
+            spans.append((chunk_start, chunk_end))
+        new_start = end - overlap
+        if new_start <= start:
+            new_start = start + 1
+        start = new_start
+    return spans
+
+
+def make_text(rnd, separators):
+    sentences = [
+        " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(3, 15))) + "."
+        for _ in range(rnd.randrange(1, 40))
+    ]
+    return "".join(sentence + rnd.choice(separators) for sentence in sentences).rstrip()
+
+
+@pytest.fixture
+def service():
+    return EmbeddingService(object())
+
+
+@pytest.fixture
+def character_mode(monkeypatch):
+    # Measure chunks in characters, as without tiktoken
+    monkeypatch.setattr(embedding_service, "token_offsets", lambda text: None)
+
+
+@pytest.fixture
+def token_mode(monkeypatch):
+    # A token every 4 characters, so tests don't need to download the encoding
+    monkeypatch.setattr(embedding_service, "token_offsets", lambda text: list(range(0, len(text), 4)))
+
+
+def test_empty_text_has_no_chunks(service):
+    assert service.chunk_offsets("") == []
+    assert service.chunk_text("  \n\n ") == []
+
+
+def test_matches_baseline_on_running_text(service, character_mode):
+    rnd = random.Random(1)
+    for _ in range(300):
+        text = make_text(rnd, [" "])
+        assert service.chunk_offsets(text, 200, 30) == baseline_spans(text, 200, 30)
+
+
+def test_chunks_cover_text_with_bounded_overlap(service, character_mode):
+    rnd = random.Random(2)
+    for _ in range(300):
+        text = make_text(rnd, [" ", "\n", "\n\n"])
+        spans = service.chunk_offsets(text, 200, 30)
+        covered = set()
+        for start, end in spans:
+            assert end - start <= 200
+            covered.update(range(start, end))
+        assert {i for i, c in enumerate(text) if not c.isspace()} <= covered
+        for (prev_start, prev_end), (start, end) in zip(spans, spans[1:]):
+            # Always advancing, and never sharing more than the overlap
+            assert start > prev_start and end > prev_end
+            assert prev_end - start <= 30
+
+
+def test_chunk_text_materializes_spans(service, character_mode):
+    text = make_text(random.Random(3), [" ", "\n\n"])
+    spans = service.chunk_offsets(text, 120, 20)
+    assert service.chunk_text(text, 120, 20) == [text[start:end] for start, end in spans]
+
+
+def test_token_chunks_stay_within_size(service, token_mode):
+    rnd = random.Random(4)
+    for _ in range(100):
+        text = make_text(rnd, [" ", "\n", "\n\n"])
+        spans = service.chunk_offsets(text, 64, 8)
+        covered = set()
+        for start, end in spans:
+            assert end - start <= 64 * 4
+            covered.update(range(start, end))
+        assert {i for i, c in enumerate(text) if not c.isspace()} <= covered
+        for (prev_start, prev_end), (start, end) in zip(spans, spans[1:]):
+            assert start > prev_start and end > prev_end
+            # The overlap starts at a token boundary, up to a token before 8 tokens back
+            assert prev_end - start <= (8 + 1) * 4
@@ -0,0 +1,155 @@
+import asyncio
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from aiolimiter import AsyncLimiter
+from openai import RateLimitError
+
+from app.services import embedding_helper
+from app.services.embedding_helper import OpenAIClient, generate_embeddings
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(429, headers=headers, request=request)
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def retry_state(error, attempt_number=1):
+    return SimpleNamespace(
+        outcome=SimpleNamespace(exception=lambda: error),
+        attempt_number=attempt_number
+    )
+
+
+class FakeEmbeddings:
+    """Returns one embedding per input, its first component the input's length."""
+
+    def __init__(self):
+        self.batches = []
+        self.failures = []
+
+    async def create(self, model, input):
+        self.batches.append(list(input))
+        if self.failures:
+            raise self.failures.pop(0)
+        # Out of order on purpose; results are matched up by index
+        data = [
+            SimpleNamespace(index=i, embedding=[float(len(text)), 1.0])
+            for i, text in enumerate(input)
+        ]
+        return SimpleNamespace(data=data[::-1])
+
+
+@pytest.fixture(autouse=True)
+def fresh_request_gates(monkeypatch):
+    """Give each test's event loop its own request semaphore and rate limiter."""
+    monkeypatch.setattr(
+        embedding_helper, "_request_semaphore",
+        asyncio.Semaphore(embedding_helper.settings.OPENAI_CONCURRENCY)
+    )
+    monkeypatch.setattr(
+        embedding_helper, "_request_limiter",
+        AsyncLimiter(embedding_helper.settings.OPENAI_RPM, 60)
+    )
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = SimpleNamespace(embeddings=FakeEmbeddings())
+    monkeypatch.setattr(OpenAIClient, "get_client", classmethod(lambda cls, api_key=None: client))
+    # Character counting, so tests don't need to download the tiktoken encoding
+    monkeypatch.setattr(embedding_helper, "tiktoken", None)
+    monkeypatch.setattr(embedding_helper.random, "uniform", lambda a, b: 0.0)
+    embedding_helper._embedding_cache.clear()
+    yield client
+    embedding_helper._embedding_cache.clear()
+
+
+def test_embeddings_are_batched_in_input_order(fake_client):
+    texts = [f"text number {i}" + "x" * i for i in range(5)]
+
+    embeddings = asyncio.run(generate_embeddings(texts, batch_size=2))
+
+    assert [len(batch) for batch in fake_client.embeddings.batches] == [2, 2, 1]
+    assert [embedding[0] for embedding in embeddings] == [float(len(text)) for text in texts]
+
+
+def test_repeated_texts_are_served_from_cache(fake_client):
+    async def main():
+        first = await generate_embeddings(["cached text", "other text"])
+        second = await generate_embeddings(["other text", "new text", "cached text"])
+        second[0][0] = -1.0
+        third = await generate_embeddings(["other text"])
+        return first, second, third
+
+    first, second, third = asyncio.run(main())
+
+    assert fake_client.embeddings.batches == [["cached text", "other text"], ["new text"]]
+    assert second[2] == first[0]
+    assert third == first[1:]
+
+
+def test_repeated_texts_in_one_call_are_embedded_once(fake_client):
+    texts = ["repeated text", "other text", "repeated text"]
+
+    embeddings = asyncio.run(generate_embeddings(texts))
+
+    assert fake_client.embeddings.batches == [["repeated text", "other text"]]
+    assert embeddings[0] == embeddings[2]
+    assert embeddings[0] is not embeddings[2]
+
+
+def test_retry_wait_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(embedding_helper.random, "uniform", lambda a, b: 0.0)
+
+    assert embedding_helper._retry_wait(retry_state(rate_limit_error({"retry-after-ms": "1500"}))) == 1.5
+    assert embedding_helper._retry_wait(retry_state(rate_limit_error({"retry-after": "7"}))) == 7.0
+    assert embedding_helper._retry_wait(retry_state(rate_limit_error({"retry-after": "3600"}))) == 60.0
+
+
+def test_retry_wait_backs_off_without_retry_after():
+    wait = embedding_helper._retry_wait(retry_state(rate_limit_error({}), attempt_number=1))
+    assert 0 < wait <= 10
+
+
+def test_rate_limited_batch_is_retried(fake_client):
+    fake_client.embeddings.failures.append(rate_limit_error({"retry-after-ms": "10"}))
+
+    embeddings = asyncio.run(generate_embeddings(["retried text"]))
+
+    assert fake_client.embeddings.batches == [["retried text"], ["retried text"]]
+    assert embeddings == [[float(len("retried text")), 1.0]]
+
+
+def test_least_recently_used_clients_are_closed(monkeypatch):
+    monkeypatch.setattr(OpenAIClient, "_clients", OrderedDict())
+    monkeypatch.setattr(embedding_helper, "OPENAI_CLIENT_CACHE_SIZE", 2)
+    monkeypatch.setattr(embedding_helper, "OPENAI_CLIENT_CLOSE_DELAY", 0)
+
+    async def main():
+        first = OpenAIClient.get_client("sk-first")
+        second = OpenAIClient.get_client("sk-second")
+        assert OpenAIClient.get_client("sk-first") is first
+        OpenAIClient.get_client("sk-third")
+        await asyncio.gather(*OpenAIClient._closing)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert list(OpenAIClient._clients) == ["sk-first", "sk-third"]
+    assert second.is_closed()
+    assert not first.is_closed()
+
+
+def test_log_counts_only_real_cache_hits(fake_client, caplog):
+    async def main():
+        await generate_embeddings(["cached text"])
+        caplog.clear()
+        await generate_embeddings(["cached text", "new text", "new text", "  "], skip_invalid=True)
+
+    with caplog.at_level("INFO", logger=embedding_helper.logger.name):
+        asyncio.run(main())
+
+    assert "Successfully generated 1 embeddings (1 cached, 1 repeated)" in caplog.messages
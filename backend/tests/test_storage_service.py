@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import storage_service
+from app.services.storage_service import EmbeddingLoader, StorageService
+
+
+class FakeQuery:
+    def __init__(self, client):
+        self.client = client
+        self.ids = None
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        self.ids = list(values)
+        return self
+
+    def execute(self):
+        self.client.queries.append(self.ids)
+        if any(embedding_id.startswith("bad") for embedding_id in self.ids):
+            raise ValueError("invalid input syntax for type uuid")
+        rows = [self.client.rows[i] for i in self.ids if i in self.client.rows]
+        return SimpleNamespace(data=rows)
+
+
+class FakeSupabase:
+    """Answers embeddings lookups by id and records each query's ids."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def table(self, name):
+        assert name == "embeddings"
+        return FakeQuery(self)
+
+
+def row(embedding_id, file_id="f1"):
+    return {"id": embedding_id, "file_id": file_id, "text": f"text {embedding_id}"}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    storage_service._embedding_cache._data.clear()
+    yield
+    storage_service._embedding_cache._data.clear()
+
+
+def test_concurrent_loads_share_one_query():
+    client = FakeSupabase({"a": row("a"), "b": row("b")})
+    loader = EmbeddingLoader(client)
+
+    async def main():
+        return await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("c"))
+
+    a, b, a_again, c = asyncio.run(main())
+    assert client.queries == [["a", "b", "c"]]
+    assert a == row("a") and a_again == row("a") and b == row("b")
+    assert c is None
+
+
+def test_failed_batch_falls_back_to_single_lookups():
+    client = FakeSupabase({"a": row("a"), "b": row("b")})
+    loader = EmbeddingLoader(client)
+
+    async def main():
+        return await asyncio.gather(
+            loader.load("a"), loader.load("bad"), loader.load("b"),
+            return_exceptions=True
+        )
+
+    a, bad, b = asyncio.run(main())
+    assert client.queries[0] == ["a", "bad", "b"]
+    assert sorted(client.queries[1:]) == [["a"], ["b"], ["bad"]]
+    assert a == row("a") and b == row("b")
+    assert isinstance(bad, ValueError)
+
+
+def test_single_lookup_failure_propagates():
+    loader = EmbeddingLoader(FakeSupabase({}))
+
+    with pytest.raises(ValueError):
+        asyncio.run(loader.load("bad"))
+
+
+def test_get_embedding_returns_copies(tmp_path):
+    service = StorageService(FakeSupabase({"a": row("a")}), storage_dir=str(tmp_path))
+
+    first = asyncio.run(service.get_embedding("a"))
+    first["text"] = "changed"
+    assert asyncio.run(service.get_embedding("a")) == row("a")
+
+
+def test_invalidate_file_embeddings_drops_cached_rows(tmp_path):
+    client = FakeSupabase({"a": row("a", "f1"), "b": row("b", "f2")})
+    service = StorageService(client, storage_dir=str(tmp_path))
+
+    async def main():
+        await asyncio.gather(service.get_embedding("a"), service.get_embedding("b"))
+        storage_service.invalidate_file_embeddings("f1")
+        del client.rows["a"]
+        return await service.get_embedding("a"), await service.get_embedding("b")
+
+    a, b = asyncio.run(main())
+    assert a is None
+    assert b == row("b", "f2")
+    assert len(client.queries) == 2
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from app.services import upload_service
+from app.services.upload_service import UploadService
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.inserted = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def insert(self, row):
+        self.inserted = row
+        return self
+
+    def update(self, values):
+        self.client.updates.append(values)
+        return self
+
+    def execute(self):
+        if self.inserted is None:
+            return SimpleNamespace(data=[])
+        row = dict(self.inserted, id=str(uuid4()), created_at=datetime.now(timezone.utc).isoformat())
+        return SimpleNamespace(data=[row])
+
+
+class FakeBucket:
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, path, file):
+        # Read while the spooled file is still open, as storage3 does
+        self.client.uploads.append((path, type(file), file.read()))
+        return SimpleNamespace()
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.uploads = []
+        self.updates = []
+        self.storage = SimpleNamespace(from_=lambda bucket: FakeBucket(self))
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeEmbeddingService:
+    def __init__(self):
+        self.texts = []
+
+    async def generate_and_save_embedding(self, text, file_id, user_id, api_key=None):
+        self.texts.append(text)
+
+
+@pytest.fixture
+def spool_paths(monkeypatch):
+    """Record the temporary files uploads are spooled to."""
+    paths = []
+    named_temporary_file = upload_service.tempfile.NamedTemporaryFile
+
+    def recording_temporary_file(*args, **kwargs):
+        spool = named_temporary_file(*args, **kwargs)
+        paths.append(spool.name)
+        return spool
+
+    monkeypatch.setattr(upload_service.tempfile, "NamedTemporaryFile", recording_temporary_file)
+    return paths
+
+
+def upload(content, filename="notes.txt"):
+    return UploadFile(file=io.BytesIO(content), filename=filename)
+
+
+def test_upload_is_streamed_from_a_spooled_file(spool_paths):
+    client = FakeSupabase()
+    embedding_service = FakeEmbeddingService()
+    service = UploadService(client, embedding_service=embedding_service)
+    content = b"line of text\n" * 20_000  # Several UPLOAD_CHUNK_SIZE reads
+
+    response = asyncio.run(service.save_file(upload(content), uuid4()))
+
+    assert response.status == "success"
+    assert response.embedding_status == "completed"
+    [(path, file_type, uploaded)] = client.uploads
+    assert path.endswith("/notes.txt")
+    assert issubclass(file_type, io.BufferedReader)
+    assert uploaded == content
+    assert embedding_service.texts == [content.decode()]
+    assert client.updates == [{"status": "indexed"}]
+    assert not os.path.exists(spool_paths[0])
+
+
+def test_oversized_upload_is_rejected_before_storage(monkeypatch, spool_paths):
+    monkeypatch.setattr(upload_service.settings, "MAX_UPLOAD_SIZE", 100_000)
+    client = FakeSupabase()
+    service = UploadService(client, embedding_service=FakeEmbeddingService())
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(service.save_file(upload(b"x" * 100_001), uuid4()))
+
+    assert excinfo.value.status_code == 413
+    assert client.uploads == []
+    assert not os.path.exists(spool_paths[0])
+
+
+@pytest.mark.parametrize("filename", [
+    "notes.txt", "my notes (v2).md", "a/b\\c:d*e?.txt", "café über.txt", "日記.md", "tab\tname.txt"
+])
+def test_sanitize_filename_matches_regex(filename):
+    service = UploadService(FakeSupabase(), embedding_service=FakeEmbeddingService())
+
+    assert service._sanitize_filename(filename) == upload_service._UNSAFE_FILENAME_RE.sub("_", filename)
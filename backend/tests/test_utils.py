@@ -0,0 +1,60 @@
+import pytest
+
+from app.core import utils
+from app.core.utils import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    clock[0] += 9.9
+    assert cache.get("a") == 1
+    clock[0] += 0.1
+    assert cache.get("a") is None
+    assert cache.get("a", "missing") == "missing"
+
+
+def test_set_refreshes_expiry(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    clock[0] += 8
+    cache.set("a", 2)
+    clock[0] += 8
+    assert cache.get("a") == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_pop_drops_an_entry(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    cache.pop("missing")
+    cache.pop("a")
+    assert cache.get("a") is None
+
+
+def test_pop_where_drops_matching_entries(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", {"file_id": "f1"})
+    cache.set("b", {"file_id": "f2"})
+    cache.set("c", {"file_id": "f1"})
+    cache.pop_where(lambda row: row["file_id"] == "f1")
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert cache.get("b") == {"file_id": "f2"}